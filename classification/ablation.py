@@ -17,10 +17,10 @@ import torch.utils.data
 import torch.utils.data.distributed
 from torch.utils.data import DataLoader
 import models as models
-from utils import Logger, mkdir_p, progress_bar, save_model, save_args, cal_loss
+from utils import Logger, mkdir_p, progress_bar, save_model, save_args, cal_loss, ConfusionMatrix, RunningMetrics, \
+    stratified_subset, stratified_mean
 from data import ModelNet40
 from torch.optim.lr_scheduler import CosineAnnealingLR
-import sklearn.metrics as metrics
 import numpy as np
 
 
@@ -38,6 +38,9 @@ def parse_args():
     parser.add_argument('--weight_decay', type=float, default=1e-4, help='decay rate')
     parser.add_argument('--seed', type=int, help='random seed')
     parser.add_argument('--workers', default=8, type=int, help='workers')
+    parser.add_argument('--eval_per_class', default=0, type=int,
+                        help='validate on a fixed stratified subset with this many samples per class, 0 for all')
+    parser.add_argument('--eval_seed', default=0, type=int, help='seed of the stratified subset')
     return parser.parse_args()
 
 
@@ -128,8 +131,16 @@ def main():
     printf('==> Preparing data..')
     train_loader = DataLoader(ModelNet40(partition='train', num_points=args.num_points), num_workers=args.workers,
                               batch_size=args.batch_size, shuffle=True, drop_last=True)
-    test_loader = DataLoader(ModelNet40(partition='test', num_points=args.num_points), num_workers=args.workers,
-                             batch_size=args.batch_size//2, shuffle=True, drop_last=False)
+    test_set = ModelNet40(partition='test', num_points=args.num_points)
+    population = None
+    if args.eval_per_class > 0:
+        # the same stratified subset every epoch; loss/acc are then estimates of the full split, with 95% intervals.
+        population = torch.bincount(torch.from_numpy(np.array(test_set.label)).view(-1))
+        test_set = torch.utils.data.Subset(test_set, stratified_subset(test_set.label, args.eval_per_class,
+                                                                       args.eval_seed))
+        printf(f"==> Validating on {len(test_set)} stratified test samples (seed {args.eval_seed})")
+    test_loader = DataLoader(test_set, num_workers=args.workers,
+                             batch_size=args.batch_size//2, shuffle=args.eval_per_class <= 0, drop_last=False)
 
     optimizer = torch.optim.SGD(net.parameters(), lr=args.learning_rate, momentum=0.9, weight_decay=args.weight_decay)
     if optimizer_dict is not None:
@@ -140,7 +151,7 @@ def main():
     for epoch in range(start_epoch, args.epoch):
         printf('Epoch(%d/%s) Learning Rate %s:' % (epoch + 1, args.epoch, optimizer.param_groups[0]['lr']))
         train_out = train(net, train_loader, optimizer, criterion, device)  # {"loss", "acc", "acc_avg", "time"}
-        test_out = validate(net, test_loader, criterion, device)
+        test_out = validate(net, test_loader, criterion, device, population)
         scheduler.step()
 
         if test_out["acc"] > best_test_acc:
@@ -172,9 +183,10 @@ def main():
                        test_out["loss"], test_out["acc_avg"], test_out["acc"]])
         printf(
             f"Training loss:{train_out['loss']} acc_avg:{train_out['acc_avg']}% acc:{train_out['acc']}% time:{train_out['time']}s")
+        ci = "" if population is None else f" (95% ci loss:±{test_out['loss_ci']} acc:±{test_out['acc_ci']}%)"
         printf(
             f"Testing loss:{test_out['loss']} acc_avg:{test_out['acc_avg']}% "
-            f"acc:{test_out['acc']}% time:{test_out['time']}s [best test acc: {best_test_acc}%] \n\n")
+            f"acc:{test_out['acc']}%{ci} time:{test_out['time']}s [best test acc: {best_test_acc}%] \n\n")
     logger.close()
 
     printf(f"++++++++" * 2 + "Final results" + "++++++++" * 2)
@@ -189,11 +201,8 @@ def main():
 
 def train(net, trainloader, optimizer, criterion, device):
     net.train()
-    train_loss = 0
-    correct = 0
-    total = 0
-    train_pred = []
-    train_true = []
+    metrics = RunningMetrics(len(trainloader))
+    confusion = ConfusionMatrix()
     time_cost = datetime.datetime.now()
     for batch_idx, (data, label) in enumerate(trainloader):
         data, label = data.to(device), label.to(device).squeeze()
@@ -204,36 +213,30 @@ def train(net, trainloader, optimizer, criterion, device):
         loss.backward()
         torch.nn.utils.clip_grad_norm_(net.parameters(), 1)
         optimizer.step()
-        train_loss += loss.item()
         preds = logits.max(dim=1)[1]
 
-        train_true.append(label.cpu().numpy())
-        train_pred.append(preds.detach().cpu().numpy())
+        confusion.update(logits.detach(), label)
 
-        total += label.size(0)
-        correct += preds.eq(label).sum().item()
-
-        progress_bar(batch_idx, len(trainloader), 'Loss: %.3f | Acc: %.3f%% (%d/%d)'
-                     % (train_loss / (batch_idx + 1), 100. * correct / total, correct, total))
+        metrics.update(loss, preds, label)
 
     time_cost = int((datetime.datetime.now() - time_cost).total_seconds())
-    train_true = np.concatenate(train_true)
-    train_pred = np.concatenate(train_pred)
     return {
-        "loss": float("%.3f" % (train_loss / (batch_idx + 1))),
-        "acc": float("%.3f" % (100. * metrics.accuracy_score(train_true, train_pred))),
-        "acc_avg": float("%.3f" % (100. * metrics.balanced_accuracy_score(train_true, train_pred))),
+        "loss": float("%.3f" % metrics.loss()),
+        "acc": float("%.3f" % (100. * confusion.accuracy())),
+        "acc_avg": float("%.3f" % (100. * confusion.balanced_accuracy())),
         "time": time_cost
     }
 
 
-def validate(net, testloader, criterion, device):
+def validate(net, testloader, criterion, device, population=None):
+    """
+    With population (class sizes of the whole test split), testloader is a stratified subset of it and
+    loss/acc are stratified estimates of the whole split, with their 95% half-widths loss_ci/acc_ci.
+    """
     net.eval()
-    test_loss = 0
-    correct = 0
-    total = 0
-    test_true = []
-    test_pred = []
+    metrics = RunningMetrics(len(testloader))
+    confusion = ConfusionMatrix()
+    sample_losses, sample_corrects, sample_labels = [], [], []
     time_cost = datetime.datetime.now()
     with torch.no_grad():
         for batch_idx, (data, label) in enumerate(testloader):
@@ -241,24 +244,30 @@ def validate(net, testloader, criterion, device):
             data = data.permute(0, 2, 1)
             logits = net(data)
             loss = criterion(logits, label)
-            test_loss += loss.item()
             preds = logits.max(dim=1)[1]
-            test_true.append(label.cpu().numpy())
-            test_pred.append(preds.detach().cpu().numpy())
-            total += label.size(0)
-            correct += preds.eq(label).sum().item()
-            progress_bar(batch_idx, len(testloader), 'Loss: %.3f | Acc: %.3f%% (%d/%d)'
-                         % (test_loss / (batch_idx + 1), 100. * correct / total, correct, total))
+            confusion.update(logits.detach(), label)
+            if population is not None:
+                sample_losses.append(criterion(logits, label, reduction='none'))
+                sample_corrects.append(preds.eq(label) * 100.)
+                sample_labels.append(label)
+            metrics.update(loss, preds, label)
 
     time_cost = int((datetime.datetime.now() - time_cost).total_seconds())
-    test_true = np.concatenate(test_true)
-    test_pred = np.concatenate(test_pred)
-    return {
-        "loss": float("%.3f" % (test_loss / (batch_idx + 1))),
-        "acc": float("%.3f" % (100. * metrics.accuracy_score(test_true, test_pred))),
-        "acc_avg": float("%.3f" % (100. * metrics.balanced_accuracy_score(test_true, test_pred))),
+    out = {
+        "loss": float("%.3f" % metrics.loss()),
+        "acc": float("%.3f" % (100. * confusion.accuracy())),
+        "acc_avg": float("%.3f" % (100. * confusion.balanced_accuracy())),
         "time": time_cost
     }
+    if population is not None:
+        sample_labels = torch.cat(sample_labels)
+        loss, loss_ci = stratified_mean(torch.cat(sample_losses).unsqueeze(0), sample_labels, population)
+        acc, acc_ci = stratified_mean(torch.cat(sample_corrects).unsqueeze(0), sample_labels, population)
+        out.update({
+            "loss": float("%.3f" % loss.item()), "loss_ci": float("%.3f" % loss_ci.item()),
+            "acc": float("%.3f" % acc.item()), "acc_ci": float("%.3f" % acc_ci.item())
+        })
+    return out
 
 
 if __name__ == '__main__':
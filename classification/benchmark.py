@@ -0,0 +1,208 @@
+"""
+Throughput/latency benchmark for any model in models/, without data loading, optimizer bookkeeping or progress bar.
+For every (model, batch_size, num_points) it measures
+    forward latency p50/p95/p99 (eval mode), forward+backward+step time (train mode),
+    peak memory (cuda: max allocated, cpu: peak RSS over the RSS before the measurement) and points/sec,
+and writes everything to a JSON file, so regressions between model31/32/33/elite variants are visible.
+On cpu every measurement runs in a fresh process, as the peak RSS of a process only ever grows.
+Usage:
+python benchmark.py --models model31C model32A modelelite3X10 --batch_sizes 1 16 32 --num_points 1024
+python benchmark.py --models model31C --device cpu --output benchmark_cpu.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+import torch
+import models as models
+from helper import cal_loss
+
+
+def parse_args():
+    """Parameters"""
+    parser = argparse.ArgumentParser('benchmark')
+    parser.add_argument('--models', nargs='+', default=['model31C'], help='model names in models.__dict__')
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=[1, 16, 32])
+    parser.add_argument('--num_points', nargs='+', type=int, default=[1024])
+    parser.add_argument('--num_classes', type=int, default=40, help='label range for the backward pass')
+    parser.add_argument('--device', default=None, help='cuda or cpu (default: cuda if available)')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--no_backward', action='store_true', help='skip the forward+backward measurement')
+    parser.add_argument('--output', type=str, help='json path (default: benchmark-{time}.json)')
+    return parser.parse_args()
+
+
+def sync(device):
+    if device == 'cuda':
+        torch.cuda.synchronize()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100.
+    low, high = int(k), min(int(k) + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):  # no procfs, fall back to the peak so far
+        return max_rss_mb()
+
+
+def max_rss_mb():
+    # ru_maxrss is in KB on linux; it is the peak of the whole process.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def reset_peak_memory(device):
+    """Return the baseline of the next peak_memory_mb call."""
+    if device == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+        return 0.
+    return current_rss_mb()
+
+
+def peak_memory_mb(device, baseline):
+    if device == 'cuda':
+        return torch.cuda.max_memory_allocated() / 2 ** 20
+    return max_rss_mb() - baseline
+
+
+def time_forward(net, data, device, warmup, repeat):
+    net.eval()
+    times = []
+    with torch.no_grad():
+        for i in range(warmup + repeat):
+            sync(device)
+            start = time.perf_counter()
+            net(data)
+            sync(device)
+            if i >= warmup:
+                times.append((time.perf_counter() - start) * 1000.)
+    return times
+
+
+def time_step(net, data, label, device, warmup, repeat):
+    net.train()
+    optimizer = torch.optim.SGD(net.parameters(), lr=1e-4, momentum=0.9)
+    times = []
+    for i in range(warmup + repeat):
+        sync(device)
+        start = time.perf_counter()
+        optimizer.zero_grad()
+        loss = cal_loss(net(data), label)
+        loss.backward()
+        optimizer.step()
+        sync(device)
+        if i >= warmup:
+            times.append((time.perf_counter() - start) * 1000.)
+    return times
+
+
+def measure(phase, name, batch_size, num_points, device, args):
+    """
+    One measurement ("forward" or "step") of one config; returns the result entries.
+    """
+    torch.manual_seed(0)
+    net = models.__dict__[name]().to(device)
+    data = torch.rand(batch_size, 3, num_points, device=device)
+    if device == 'cuda':
+        torch.cuda.empty_cache()
+    if phase == "forward":
+        baseline = reset_peak_memory(device)
+        times = time_forward(net, data, device, args.warmup, args.repeat)
+        return {
+            "params_m": sum(p.numel() for p in net.parameters()) / 1e6,
+            "forward_ms_p50": percentile(times, 50),
+            "forward_ms_p95": percentile(times, 95),
+            "forward_ms_p99": percentile(times, 99),
+            "forward_ms_mean": sum(times) / len(times),
+            "points_per_sec": batch_size * num_points / (percentile(times, 50) / 1000.),
+            "forward_peak_memory_mb": peak_memory_mb(device, baseline)
+        }
+    label = torch.randint(0, args.num_classes, (batch_size,), device=device)
+    baseline = reset_peak_memory(device)
+    times = time_step(net, data, label, device, args.warmup, args.repeat)
+    return {
+        "step_ms_p50": percentile(times, 50),
+        "step_ms_mean": sum(times) / len(times),
+        "step_peak_memory_mb": peak_memory_mb(device, baseline)
+    }
+
+
+def run_measure(phase, name, batch_size, num_points, device, args):
+    """measure() in this process on cuda, in a fresh process on cpu"""
+    if device == 'cuda':
+        return measure(phase, name, batch_size, num_points, device, args)
+    torch_threads = torch.get_num_threads()
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(measure_fresh, torch_threads, phase, name, batch_size, num_points, device, args).result()
+
+
+def measure_fresh(torch_threads, *args):
+    torch.set_num_threads(torch_threads)
+    return measure(*args)
+
+
+def benchmark(name, batch_size, num_points, device, args):
+    result = {"model": name, "batch_size": batch_size, "num_points": num_points, "device": device}
+    try:
+        result.update(run_measure("forward", name, batch_size, num_points, device, args))
+        # BatchNorm cannot train on a single sample.
+        if not args.no_backward and batch_size > 1:
+            result.update(run_measure("step", name, batch_size, num_points, device, args))
+    except RuntimeError as e:  # e.g. out of memory, keep going with the other configs
+        result["error"] = str(e).split('\n')[0]
+    return result
+
+
+def main():
+    args = parse_args()
+    print(f"args: {args}")
+    device = args.device if args.device is not None else ('cuda' if torch.cuda.is_available() else 'cpu')
+    if device == 'cuda':
+        torch.backends.cudnn.benchmark = True
+    if args.output is None:
+        args.output = 'benchmark' + str(datetime.datetime.now().strftime('-%Y%m%d%H%M%S')) + '.json'
+    report = {
+        "env": {
+            "torch": torch.__version__,
+            "device": torch.cuda.get_device_name() if device == 'cuda' else platform.processor(),
+            "threads": torch.get_num_threads(),
+            "warmup": args.warmup,
+            "repeat": args.repeat,
+            "time": str(datetime.datetime.now())
+        },
+        "results": []
+    }
+    for name in args.models:
+        for num_points in args.num_points:
+            for batch_size in args.batch_sizes:
+                result = benchmark(name, batch_size, num_points, device, args)
+                report["results"].append(result)
+                if "error" in result:
+                    print(f"{name} bs={batch_size} N={num_points}: {result['error']}")
+                    continue
+                print(f"{name} bs={batch_size} N={num_points}: "
+                      f"fwd p50/p95/p99 {result['forward_ms_p50']:.2f}/{result['forward_ms_p95']:.2f}/"
+                      f"{result['forward_ms_p99']:.2f}ms | step {result.get('step_ms_p50', float('nan')):.2f}ms | "
+                      f"{result['points_per_sec']:.0f} points/s | peak {result['forward_peak_memory_mb']:.0f}MB")
+                # flush after every config, so a crash keeps the finished measurements.
+                with open(args.output, 'w') as f:
+                    json.dump(report, f, indent=2)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"==> Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
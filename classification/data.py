@@ -2,6 +2,7 @@ import os
 import glob
 import h5py
 import numpy as np
+import torch
 from torch.utils.data import Dataset
 os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
 
@@ -35,6 +36,41 @@ def load_data(partition):
     all_label = np.concatenate(all_label, axis=0)
     return all_data, all_label
 
+def cache_data(partition):
+    """
+    One-time conversion of the h5 files into flat float32/int64 .npy arrays, so that later
+    runs can np.load(..., mmap_mode='r') them instead of decoding and concatenating the h5 files.
+    The .npy header is padded to 64 bytes, so the payload stays aligned for the memory map.
+    Return: (data_path, label_path)
+    """
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    CACHE_DIR = os.path.join(BASE_DIR, 'data', 'modelnet40_npy_cache')
+    data_path = os.path.join(CACHE_DIR, '%s_data.npy' % partition)
+    label_path = os.path.join(CACHE_DIR, '%s_label.npy' % partition)
+    if os.path.exists(data_path) and os.path.exists(label_path):
+        return data_path, label_path
+    if not os.path.exists(CACHE_DIR):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+    all_data, all_label = load_data(partition)
+    # write to a per-process temporary file first, so concurrent jobs never see a half-written cache.
+    for path, array in [(data_path, np.ascontiguousarray(all_data)), (label_path, np.ascontiguousarray(all_label))]:
+        tmp_path = '%s.%d.tmp.npy' % (path[:-4], os.getpid())
+        np.save(tmp_path, array)
+        os.replace(tmp_path, path)
+    return data_path, label_path
+
+
+def load_data_memmap(partition):
+    """
+    Read-only memory-mapped version of load_data. Pages are shared by all DataLoader workers
+    (and all processes on the node) through the OS page cache, instead of one private copy each.
+    """
+    data_path, label_path = cache_data(partition)
+    all_data = np.load(data_path, mmap_mode='r')
+    all_label = np.load(label_path, mmap_mode='r')
+    return all_data, all_label
+
+
 def random_point_dropout(pc, max_dropout_ratio=0.875):
     ''' batch_pc: BxNx3 '''
     # for b in range(batch_pc.shape[0]):
@@ -59,16 +95,63 @@ def jitter_pointcloud(pointcloud, sigma=0.01, clip=0.02):
     return pointcloud
 
 
+class BatchTranslateShuffle(object):
+    """
+    Batched version of translate_pointcloud + np.random.shuffle for a [B, N, 3] tensor (after .to(device)).
+    Every sample still draws its own anisotropic scale, shift and point permutation. The draws come from a
+    torch.Generator on the data's device, seeded once, so a run is reproducible from its seed.
+    Works on both cuda and cpu tensors.
+    """
+    def __init__(self, scale_low=2. / 3., scale_high=3. / 2., shift_range=0.2, shuffle=True, seed=None):
+        self.scale_low = scale_low
+        self.scale_high = scale_high
+        self.shift_range = shift_range
+        self.shuffle = shuffle
+        self.seed = seed
+        self.generators = {}
+
+    def _generator(self, device):
+        key = str(device)
+        if key not in self.generators:
+            generator = torch.Generator(device=device)
+            if self.seed is not None:
+                generator.manual_seed(self.seed)
+            else:
+                generator.seed()
+            self.generators[key] = generator
+        return self.generators[key]
+
+    def __call__(self, pc):
+        B, N, C = pc.shape
+        generator = self._generator(pc.device)
+        xyz1 = torch.empty(B, 1, C, device=pc.device, dtype=pc.dtype).uniform_(
+            self.scale_low, self.scale_high, generator=generator)
+        xyz2 = torch.empty(B, 1, C, device=pc.device, dtype=pc.dtype).uniform_(
+            -self.shift_range, self.shift_range, generator=generator)
+        pc = torch.addcmul(xyz2, pc, xyz1)
+        if self.shuffle:
+            # argsort of i.i.d. uniforms is a uniform random permutation, drawn independently per sample.
+            perm = torch.rand(B, N, device=pc.device, generator=generator).argsort(dim=1)
+            pc = torch.gather(pc, 1, perm.unsqueeze(-1).expand(-1, -1, C))
+        return pc
+
+
 class ModelNet40(Dataset):
-    def __init__(self, num_points, partition='train'):
-        self.data, self.label = load_data(partition)
+    def __init__(self, num_points, partition='train', memmap=True, augment=True):
+        if memmap:
+            self.data, self.label = load_data_memmap(partition)
+        else:
+            self.data, self.label = load_data(partition)
         self.num_points = num_points
-        self.partition = partition        
+        self.partition = partition
+        # set augment=False when the batch is augmented on device with BatchTranslateShuffle instead.
+        self.augment = augment
 
     def __getitem__(self, item):
-        pointcloud = self.data[item][:self.num_points]
-        label = self.label[item]
-        if self.partition == 'train':
+        # copy out of the (read-only) memory map; the per-sample slice is small.
+        pointcloud = np.array(self.data[item][:self.num_points])
+        label = np.array(self.label[item])
+        if self.partition == 'train' and self.augment:
             # pointcloud = random_point_dropout(pointcloud) # open for dgcnn not for our idea  for all
             pointcloud = translate_pointcloud(pointcloud)
             np.random.shuffle(pointcloud)
@@ -0,0 +1,73 @@
+"""
+Export an inference-only model with BatchNorm and the LocalGrouper affine folded into the convs,
+check the numerical equivalence and report the speedup on CPU and GPU.
+Usage:
+python fuse.py --model model31C
+python fuse.py --model model31C --msg 20210818204651 --save model31C_fused.pth
+"""
+import argparse
+import os
+from collections import OrderedDict
+import torch
+import models as models
+from fuse_bn import fuse_model, benchmark_fused
+
+
+def parse_args():
+    """Parameters"""
+    parser = argparse.ArgumentParser('fusing')
+    parser.add_argument('-c', '--checkpoint', type=str, metavar='PATH',
+                        help='path to best_checkpoint.pth (default: checkpoints/{model}-{msg}/best_checkpoint.pth)')
+    parser.add_argument('--msg', type=str, help='message after checkpoint, random weights if no checkpoint is given')
+    parser.add_argument('--model', default='model31C', help='model name [default: model31C]')
+    parser.add_argument('--batch_size', type=int, default=16, help='batch size for timing')
+    parser.add_argument('--num_points', type=int, default=1024, help='Point Number')
+    parser.add_argument('--repeat', type=int, default=20, help='timed forward passes')
+    parser.add_argument('--save', type=str, help='torch.save the fused module to this path')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print(f"args: {args}")
+    net = models.__dict__[args.model]()
+    if args.checkpoint is None and args.msg is not None:
+        args.checkpoint = os.path.join('checkpoints', args.model + '-' + args.msg, 'best_checkpoint.pth')
+    if args.checkpoint is not None:
+        print(f"==> Loading {args.checkpoint}")
+        checkpoint = torch.load(args.checkpoint, map_location=torch.device('cpu'))
+        new_dict = OrderedDict()
+        for k, v in checkpoint['net'].items():
+            new_dict[k[7:] if k.startswith("module.") else k] = v
+        net.load_state_dict(new_dict)
+    else:
+        # random BN statistics and affine, so that the folding is actually exercised.
+        with torch.no_grad():
+            for m in net.modules():
+                if isinstance(m, torch.nn.BatchNorm1d):
+                    m.running_mean.uniform_(-0.5, 0.5)
+                    m.running_var.uniform_(0.5, 2.)
+                if getattr(m, "affine_alpha", None) is not None:
+                    m.affine_alpha.uniform_(0.5, 1.5)
+                    m.affine_beta.uniform_(-0.5, 0.5)
+    net.eval()
+    fused = fuse_model(net)
+    num_bn = sum(isinstance(m, torch.nn.BatchNorm1d) for m in net.modules())
+    num_bn_left = sum(isinstance(m, torch.nn.BatchNorm1d) for m in fused.modules())
+    print(f"==> Folded {num_bn - num_bn_left}/{num_bn} BatchNorm layers")
+
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for device in devices:
+        net, fused = net.to(device), fused.to(device)
+        data = torch.rand(args.batch_size, 3, args.num_points, device=device)
+        diff, t_net, t_fused = benchmark_fused(net, fused, data, repeat=args.repeat)
+        print(f"[{device}] max abs diff: {diff:.3e} | original: {t_net:.2f}ms | fused: {t_fused:.2f}ms | "
+              f"speedup: {t_net / t_fused:.2f}x")
+
+    if args.save is not None:
+        torch.save(fused.cpu(), args.save)
+        print(f"==> Saved fused model to {args.save}")
+
+
+if __name__ == '__main__':
+    main()
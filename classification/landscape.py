@@ -0,0 +1,303 @@
+"""
+Loss-landscape sweep engine used by lossland.py and lossland_rand1dweight.py.
+- The perturbed weights of the model are views into one flat buffer. A grid cell (w1, w2) is written in place as
+  base + w1 * d1 + w2 * d2, instead of building a new state_dict and calling load_state_dict per cell.
+- The fixed test set is stacked on the device once, no DataLoader per cell.
+- Cells are sharded over one process per device (--devices) and over jobs (--num_shards / --shard_id).
+- Every finished cell is appended and fsync'ed to {name}_cells_{rank}.csv, and the random directions are saved to
+  {name}_directions.pth, so a restarted sweep only evaluates the missing cells.
+- --models_per_pass K evaluates K cells per forward with torch.func.vmap (falls back to one cell per forward
+  when the model cannot be vmapped).
+- Fast evaluation: --eval_per_class evaluates a fixed stratified subset (--eval_seed) of the test split, and
+  --loss_tolerance / --acc_tolerance stop a cell once the 95% half-width of its estimate is below them. Cells then
+  report "w1,w2,loss,acc,loss_ci,acc_ci,num_samples" under a name tagged with these settings.
+When all cells are done they are merged, in grid order, into {name}.txt as "w1,w2,loss,acc" lines.
+"""
+import glob
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import models as models
+from utils import cal_loss, stratified_subset, stratified_mean
+from data import ModelNet40
+
+
+def load_pretrained(path):
+    """
+    state_dict of a checkpoint saved by main.py, without the DataParallel "module." prefix.
+    """
+    checkpoint = torch.load(path, map_location=torch.device('cpu'))
+    new_dict = OrderedDict()
+    for k, v in checkpoint['net'].items():
+        new_dict[k[7:] if k.startswith("module.") else k] = v
+    return new_dict
+
+
+def rand_normalize_directions(model_name, states, ignore='biasbn'):
+    """
+    Random direction from a freshly initialized model, every weight rescaled to the norm of the pretrained one.
+    With ignore='biasbn', tensors with dim <= 1 (biases, BN parameters and statistics) get a zero direction.
+    """
+    model = models.__dict__[model_name]()
+    init_dict = model.state_dict()
+    new_dict = OrderedDict()
+    for (k, w), (k2, d) in zip(states.items(), init_dict.items()):
+        if w.dim() <= 1:
+            if ignore == 'biasbn':
+                d = torch.zeros_like(w)  # ignore directions for weights with 1 dimension
+            else:
+                d = w
+        else:
+            d.mul_(w.norm() / (d.norm() + 1e-10))
+        new_dict[k] = d
+    return new_dict
+
+
+def load_directions(path, model_name, states):
+    """
+    The two random directions of a sweep, created and saved on the first run and reloaded on resume.
+    """
+    if os.path.exists(path):
+        directions = torch.load(path, map_location=torch.device('cpu'))
+        return directions['direction1'], directions['direction2']
+    direction1 = rand_normalize_directions(model_name, states)
+    direction2 = rand_normalize_directions(model_name, states)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    torch.save({'direction1': direction1, 'direction2': direction2}, tmp_path)
+    os.replace(tmp_path, path)
+    return direction1, direction2
+
+
+class FlatPerturbation(object):
+    """
+    Loads pretrained into net and re-points every tensor with a non-zero direction into one flat buffer.
+    apply(w1, w2) writes base + w1 * d1 + w2 * d2 into that buffer in place;
+    batched(w1s, w2s) returns the [K, ...] perturbed parameters of K cells for torch.func.functional_call.
+    """
+    def __init__(self, net, pretrained, direction1, direction2):
+        net.load_state_dict(pretrained)
+        device = next(net.parameters()).device
+        # every state_dict tensor with a non-zero direction, as get_combined_weights did (this includes
+        # buffers with dim > 1, e.g. the identity of the PointNet STN)
+        tensors = list(net.named_parameters()) + [(name, b) for name, b in net.named_buffers() if b.is_floating_point()]
+        self.params = [(name, p) for name, p in tensors if direction1[name].any() or direction2[name].any()]
+        self.base = torch.cat([p.detach().reshape(-1) for _, p in self.params])
+        self.direction1 = torch.cat([direction1[name].reshape(-1) for name, _ in self.params]).to(device)
+        self.direction2 = torch.cat([direction2[name].reshape(-1) for name, _ in self.params]).to(device)
+        self.flat = self.base.clone()
+        offset = 0
+        for _, p in self.params:
+            p.data = self.flat[offset:offset + p.numel()].view_as(p)
+            offset += p.numel()
+
+    def apply(self, w1, w2):
+        torch.add(self.base, self.direction1, alpha=w1, out=self.flat)
+        self.flat.add_(self.direction2, alpha=w2)
+
+    def batched(self, w1s, w2s):
+        w1s = torch.as_tensor(w1s, dtype=self.base.dtype, device=self.base.device).view(-1, 1)
+        w2s = torch.as_tensor(w2s, dtype=self.base.dtype, device=self.base.device).view(-1, 1)
+        flat = torch.addcmul(torch.addcmul(self.base, w1s, self.direction1), w2s, self.direction2)  # [K, P]
+        params, offset = {}, 0
+        for name, p in self.params:
+            params[name] = flat[:, offset:offset + p.numel()].reshape(-1, *p.shape)
+            offset += p.numel()
+        return params
+
+
+def cache_test_set(dataset, device):
+    """
+    Whole test split on the device: data [B, 3, N], label [B].
+    """
+    data = torch.from_numpy(np.array(dataset.data[:, :dataset.num_points], dtype=np.float32))
+    label = torch.from_numpy(np.array(dataset.label, dtype=np.int64)).view(-1)
+    return data.to(device).permute(0, 2, 1).contiguous(), label.to(device)
+
+
+def evaluate_cells(forward, num_cells, data, label, batch_size, population=None, loss_tolerance=0.,
+                   acc_tolerance=0., min_samples=0, criterion=cal_loss):
+    """
+    Loss and accuracy (%) of num_cells models, forward(x) returning their logits [num_cells, b, C].
+    data/label may be a stratified_subset of the split whose class sizes are population (default: data is the
+    whole split); the results are then stratified estimates with 95% half-widths loss_ci/acc_ci.
+    With loss_tolerance/acc_tolerance > 0 (adaptive mode) the evaluation stops after the first batch that brings
+    every half-width below its tolerance, once at least min_samples samples are seen and every class has at least
+    2 of them (or all of its samples).
+    """
+    if population is None:
+        population = torch.bincount(label)
+    min_count = population.to(label.device).clamp(max=2)
+    num = data.shape[0]
+    losses = torch.zeros(num_cells, num, dtype=torch.float64, device=data.device)
+    corrects = torch.zeros(num_cells, num, dtype=torch.float64, device=data.device)
+    adaptive = loss_tolerance > 0 or acc_tolerance > 0
+    seen = num
+    with torch.no_grad():
+        for s in range(0, num, batch_size):
+            logits = forward(data[s:s + batch_size])  # [K, b, C]
+            target = label[s:s + batch_size]
+            b = target.shape[0]
+            losses[:, s:s + b] = criterion(logits.reshape(num_cells * b, -1), target.repeat(num_cells),
+                                           reduction='none').view(num_cells, b)
+            corrects[:, s:s + b] = logits.max(dim=2)[1].eq(target.unsqueeze(0)) * 100.
+            if adaptive and s + b >= min_samples and s + b < num:
+                # one host sync per batch, only in adaptive mode
+                if bool((torch.bincount(label[:s + b], minlength=min_count.shape[0]) < min_count).any()):
+                    continue
+                _, loss_ci = stratified_mean(losses[:, :s + b], label[:s + b], population)
+                _, acc_ci = stratified_mean(corrects[:, :s + b], label[:s + b], population)
+                if (loss_tolerance <= 0 or bool((loss_ci <= loss_tolerance).all())) and \
+                        (acc_tolerance <= 0 or bool((acc_ci <= acc_tolerance).all())):
+                    seen = s + b
+                    break
+    loss, loss_ci = stratified_mean(losses[:, :seen], label[:seen], population)
+    acc, acc_ci = stratified_mean(corrects[:, :seen], label[:seen], population)
+    return [{"loss": l, "acc": a, "loss_ci": lc, "acc_ci": ac, "num_samples": seen}
+            for l, a, lc, ac in zip(loss.tolist(), acc.tolist(), loss_ci.tolist(), acc_ci.tolist())]
+
+
+def evaluate(net, data, label, batch_size, **kwargs):
+    """
+    evaluate_cells() of net as it is, see there for the stratified / adaptive keyword arguments.
+    """
+    return evaluate_cells(lambda x: net(x).unsqueeze(0), 1, data, label, batch_size, **kwargs)[0]
+
+
+def evaluate_batched(net, perturbation, w1s, w2s, data, label, batch_size, **kwargs):
+    """
+    evaluate() for K cells at once: the K perturbed models run as one vmapped forward per batch.
+    In adaptive mode the K cells stop together, when all of them are within the tolerances.
+    """
+    from torch.func import functional_call, vmap
+    params = perturbation.batched(w1s, w2s)
+
+    def forward(p, x):
+        return functional_call(net, p, (x,))
+
+    return evaluate_cells(lambda x: vmap(forward, in_dims=(0, None))(params, x), len(w1s), data, label, batch_size,
+                          **kwargs)
+
+
+def cell_key(w1, w2):
+    return "{w1:.3f},{w2:.3f}".format(w1=w1, w2=w2)
+
+
+def read_finished_cells(out_dir, name):
+    finished = OrderedDict()
+    for path in sorted(glob.glob(os.path.join(out_dir, '%s_cells_*.csv' % name))):
+        with open(path, 'r') as f:
+            for line in f:
+                fields = line.strip().split(',')
+                if line.endswith('\n') and len(fields) >= 4:  # a line cut by a crash is evaluated again
+                    finished[','.join(fields[:2])] = line.strip()
+    return finished
+
+
+def is_fast_eval(args):
+    return args.eval_per_class > 0 or args.loss_tolerance > 0 or args.acc_tolerance > 0
+
+
+def fast_eval_name(args, name):
+    """
+    Output name of a sweep, tagged with the subset and the tolerances, so that cells of different evaluation
+    settings are never merged. The directions are shared with the full sweep of the same name.
+    """
+    if args.eval_per_class > 0:
+        name += '_sub%d_seed%d' % (args.eval_per_class, args.eval_seed)
+    if args.loss_tolerance > 0 or args.acc_tolerance > 0:
+        name += '_tol%g_%g' % (args.loss_tolerance, args.acc_tolerance)
+    return name
+
+
+def sweep_worker(local_rank, args, cells, name, pretrained, direction1, direction2):
+    device = args.devices[local_rank]
+    if device.startswith('cuda'):
+        torch.cuda.set_device(torch.device(device))
+        torch.backends.cudnn.benchmark = True
+    rank = args.shard_id * len(args.devices) + local_rank
+    num_ranks = args.num_shards * len(args.devices)
+    finished = read_finished_cells(args.checkpoint, name)
+    todo = [cell for k, cell in enumerate(cells) if k % num_ranks == rank and cell_key(*cell) not in finished]
+    print(f"[rank {rank}] {len(todo)} cells to evaluate on {device}")
+    if len(todo) == 0:
+        return
+
+    net = models.__dict__[args.model]().to(device)
+    net.eval()
+    perturbation = FlatPerturbation(net, pretrained, direction1, direction2)
+    data, label = cache_test_set(ModelNet40(partition='test', num_points=args.num_points), device)
+    eval_kwargs = {"population": torch.bincount(label), "loss_tolerance": args.loss_tolerance,
+                   "acc_tolerance": args.acc_tolerance, "min_samples": args.min_samples}
+    if is_fast_eval(args):
+        # the same stratified, class-interleaved order for every cell, so that the cells stay comparable.
+        per_class = args.eval_per_class if args.eval_per_class > 0 else data.shape[0]
+        index = torch.from_numpy(stratified_subset(label.cpu().numpy(), per_class, args.eval_seed)).to(device)
+        data, label = data[index], label[index]
+        print(f"[rank {rank}] evaluating on {data.shape[0]} stratified test samples (seed {args.eval_seed})")
+    batch_size = max(args.batch_size // 2, 1)
+    models_per_pass = max(args.models_per_pass, 1)
+
+    start = time.time()
+    with open(os.path.join(args.checkpoint, '%s_cells_%d.csv' % (name, rank)), 'a') as f:
+        for i in range(0, len(todo), models_per_pass):
+            chunk = todo[i:i + models_per_pass]
+            results = None
+            if len(chunk) > 1:
+                try:
+                    results = evaluate_batched(net, perturbation, [w1 for w1, _ in chunk], [w2 for _, w2 in chunk],
+                                               data, label, batch_size, **eval_kwargs)
+                except (RuntimeError, ImportError) as e:  # e.g. an op without a vmap rule, or out of memory
+                    print(f"[rank {rank}] vmap evaluation failed ({str(e).splitlines()[0]}), "
+                          f"falling back to one cell per forward")
+                    models_per_pass = 1
+            if results is None:
+                results = []
+                for w1, w2 in chunk:
+                    perturbation.apply(w1, w2)
+                    results.append(evaluate(net, data, label, batch_size, **eval_kwargs))
+            for (w1, w2), out in zip(chunk, results):
+                line = "{key},{loss:.3f},{accuracy:.3f}".format(key=cell_key(w1, w2), loss=out['loss'],
+                                                                accuracy=out['acc'])
+                if is_fast_eval(args):
+                    line += ",{loss_ci:.3f},{acc_ci:.3f},{num_samples}".format(**out)
+                f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            done = min(i + models_per_pass, len(todo))
+            print("[rank {rank}] {done}/{total} w1 {w1:.3f} w2 {w2:.3f} loss {loss:.3f} acc {acc:.3f} "
+                  "({speed:.1f}s/cell)".format(rank=rank, done=done, total=len(todo), w1=chunk[-1][0],
+                                               w2=chunk[-1][1], loss=results[-1]['loss'], acc=results[-1]['acc'],
+                                               speed=(time.time() - start) / done))
+
+
+def run_sweep(args, list_1, list_2, name):
+    """
+    Evaluate the grid list_1 x list_2 around ablation_checkpoints/{model}-loss/best_checkpoint.pth.
+    args: model, num_points, batch_size, checkpoint (output folder), devices, num_shards, shard_id, models_per_pass,
+          eval_per_class, eval_seed, loss_tolerance, acc_tolerance, min_samples
+    """
+    if args.devices is None:
+        args.devices = ['cuda'] if torch.cuda.is_available() else ['cpu']
+    pretrained = load_pretrained(os.path.join(args.checkpoint, 'best_checkpoint.pth'))
+    direction1, direction2 = load_directions(os.path.join(args.checkpoint, '%s_directions.pth' % name),
+                                             args.model, pretrained)
+    name = fast_eval_name(args, name)
+    cells = [(w1, w2) for w1 in list_1 for w2 in list_2]
+    if len(args.devices) > 1:
+        mp.spawn(sweep_worker, args=(args, cells, name, pretrained, direction1, direction2),
+                 nprocs=len(args.devices))
+    else:
+        sweep_worker(0, args, cells, name, pretrained, direction1, direction2)
+
+    finished = read_finished_cells(args.checkpoint, name)
+    missing = [cell for cell in cells if cell_key(*cell) not in finished]
+    if len(missing) > 0:
+        print(f"==> {len(missing)}/{len(cells)} cells left for the other shards")
+        return
+    with open(os.path.join(args.checkpoint, '%s.txt' % name), 'w') as f:
+        for cell in cells:
+            f.write(finished[cell_key(*cell)] + '\n')
+    print(f"==> All {len(cells)} cells saved to {os.path.join(args.checkpoint, '%s.txt' % name)}")
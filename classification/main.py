@@ -17,10 +17,9 @@ import torch.utils.data
 import torch.utils.data.distributed
 from torch.utils.data import DataLoader
 import models as models
-from utils import Logger, mkdir_p, progress_bar, save_model, save_args, cal_loss
-from data import ModelNet40
+from utils import Logger, mkdir_p, progress_bar, save_model, save_args, cal_loss, ConfusionMatrix, RunningMetrics
+from data import ModelNet40, BatchTranslateShuffle
 from torch.optim.lr_scheduler import CosineAnnealingLR
-import sklearn.metrics as metrics
 import numpy as np
 
 
@@ -39,6 +38,8 @@ def parse_args():
     parser.add_argument('--weight_decay', type=float, default=1e-4, help='decay rate')
     parser.add_argument('--seed', type=int, help='random seed')
     parser.add_argument('--workers', default=8, type=int, help='workers')
+    parser.add_argument('--gpu_aug', action='store_true', default=False,
+                        help='augment (scale/shift/shuffle) the whole batch on device instead of in the workers')
     return parser.parse_args()
 
 
@@ -126,11 +127,14 @@ def main():
 
 
     printf('==> Preparing data..')
-    train_loader = DataLoader(ModelNet40(partition='train', num_points=args.num_points), num_workers=args.workers,
+    train_loader = DataLoader(ModelNet40(partition='train', num_points=args.num_points, augment=not args.gpu_aug),
+                              num_workers=args.workers,
                               batch_size=args.batch_size, shuffle=True, drop_last=True)
     test_loader = DataLoader(ModelNet40(partition='test', num_points=args.num_points), num_workers=args.workers,
                              batch_size=args.batch_size//2, shuffle=False, drop_last=False)
 
+    augmentor = BatchTranslateShuffle(seed=args.seed) if args.gpu_aug else None
+
     optimizer = torch.optim.SGD(net.parameters(), lr=args.learning_rate, momentum=0.9, weight_decay=args.weight_decay)
     if optimizer_dict is not None:
         optimizer.load_state_dict(optimizer_dict)
@@ -139,7 +143,7 @@ def main():
 
     for epoch in range(start_epoch, args.epoch):
         printf('Epoch(%d/%s) Learning Rate %s:' % (epoch + 1, args.epoch, optimizer.param_groups[0]['lr']))
-        train_out = train(net, train_loader, optimizer, criterion, device)  # {"loss", "acc", "acc_avg", "time"}
+        train_out = train(net, train_loader, optimizer, criterion, device, augmentor)  # {"loss", "acc", "acc_avg", "time"}
         test_out = validate(net, test_loader, criterion, device)
         scheduler.step()
 
@@ -187,16 +191,15 @@ def main():
 
 
 
-def train(net, trainloader, optimizer, criterion, device):
+def train(net, trainloader, optimizer, criterion, device, augmentor=None):
     net.train()
-    train_loss = 0
-    correct = 0
-    total = 0
-    train_pred = []
-    train_true = []
+    metrics = RunningMetrics(len(trainloader))
+    confusion = ConfusionMatrix()
     time_cost = datetime.datetime.now()
     for batch_idx, (data, label) in enumerate(trainloader):
         data, label = data.to(device), label.to(device).squeeze()
+        if augmentor is not None:
+            data = augmentor(data)
         data = data.permute(0, 2, 1)  # so, the input data shape is [batch, 3, 1024]
         optimizer.zero_grad()
         logits = net(data)
@@ -204,36 +207,25 @@ def train(net, trainloader, optimizer, criterion, device):
         loss.backward()
         torch.nn.utils.clip_grad_norm_(net.parameters(), 1)
         optimizer.step()
-        train_loss += loss.item()
         preds = logits.max(dim=1)[1]
 
-        train_true.append(label.cpu().numpy())
-        train_pred.append(preds.detach().cpu().numpy())
-
-        total += label.size(0)
-        correct += preds.eq(label).sum().item()
+        confusion.update(logits.detach(), label)
 
-        progress_bar(batch_idx, len(trainloader), 'Loss: %.3f | Acc: %.3f%% (%d/%d)'
-                     % (train_loss / (batch_idx + 1), 100. * correct / total, correct, total))
+        metrics.update(loss, preds, label)
 
     time_cost = int((datetime.datetime.now() - time_cost).total_seconds())
-    train_true = np.concatenate(train_true)
-    train_pred = np.concatenate(train_pred)
     return {
-        "loss": float("%.3f" % (train_loss / (batch_idx + 1))),
-        "acc": float("%.3f" % (100. * metrics.accuracy_score(train_true, train_pred))),
-        "acc_avg": float("%.3f" % (100. * metrics.balanced_accuracy_score(train_true, train_pred))),
+        "loss": float("%.3f" % metrics.loss()),
+        "acc": float("%.3f" % (100. * confusion.accuracy())),
+        "acc_avg": float("%.3f" % (100. * confusion.balanced_accuracy())),
         "time": time_cost
     }
 
 
 def validate(net, testloader, criterion, device):
     net.eval()
-    test_loss = 0
-    correct = 0
-    total = 0
-    test_true = []
-    test_pred = []
+    metrics = RunningMetrics(len(testloader))
+    confusion = ConfusionMatrix()
     time_cost = datetime.datetime.now()
     with torch.no_grad():
         for batch_idx, (data, label) in enumerate(testloader):
@@ -241,22 +233,15 @@ def validate(net, testloader, criterion, device):
             data = data.permute(0, 2, 1)
             logits = net(data)
             loss = criterion(logits, label)
-            test_loss += loss.item()
             preds = logits.max(dim=1)[1]
-            test_true.append(label.cpu().numpy())
-            test_pred.append(preds.detach().cpu().numpy())
-            total += label.size(0)
-            correct += preds.eq(label).sum().item()
-            progress_bar(batch_idx, len(testloader), 'Loss: %.3f | Acc: %.3f%% (%d/%d)'
-                         % (test_loss / (batch_idx + 1), 100. * correct / total, correct, total))
+            confusion.update(logits.detach(), label)
+            metrics.update(loss, preds, label)
 
     time_cost = int((datetime.datetime.now() - time_cost).total_seconds())
-    test_true = np.concatenate(test_true)
-    test_pred = np.concatenate(test_pred)
     return {
-        "loss": float("%.3f" % (test_loss / (batch_idx + 1))),
-        "acc": float("%.3f" % (100. * metrics.accuracy_score(test_true, test_pred))),
-        "acc_avg": float("%.3f" % (100. * metrics.balanced_accuracy_score(test_true, test_pred))),
+        "loss": float("%.3f" % metrics.loss()),
+        "acc": float("%.3f" % (100. * confusion.accuracy())),
+        "acc_avg": float("%.3f" % (100. * confusion.balanced_accuracy())),
         "time": time_cost
     }
 
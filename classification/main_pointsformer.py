@@ -17,10 +17,9 @@ import torch.utils.data
 import torch.utils.data.distributed
 from torch.utils.data import DataLoader
 import models as models
-from utils import Logger, mkdir_p, progress_bar, save_model, save_args, cal_loss
+from utils import Logger, mkdir_p, progress_bar, save_model, save_args, cal_loss, ConfusionMatrix, RunningMetrics
 from data import ModelNet40
 from torch.optim.lr_scheduler import CosineAnnealingLR
-import sklearn.metrics as metrics
 import numpy as np
 
 
@@ -193,11 +192,8 @@ def main():
 
 def train(net, trainloader, optimizer, criterion, device):
     net.train()
-    train_loss = 0
-    correct = 0
-    total = 0
-    train_pred = []
-    train_true = []
+    metrics = RunningMetrics(len(trainloader))
+    confusion = ConfusionMatrix()
     time_cost = datetime.datetime.now()
     for batch_idx, (data, label) in enumerate(trainloader):
         data, label = data.to(device), label.to(device).squeeze()
@@ -208,36 +204,25 @@ def train(net, trainloader, optimizer, criterion, device):
         loss.backward()
         torch.nn.utils.clip_grad_norm_(net.parameters(), 1)
         optimizer.step()
-        train_loss += loss.item()
         preds = logits.max(dim=1)[1]
 
-        train_true.append(label.cpu().numpy())
-        train_pred.append(preds.detach().cpu().numpy())
+        confusion.update(logits.detach(), label)
 
-        total += label.size(0)
-        correct += preds.eq(label).sum().item()
-
-        progress_bar(batch_idx, len(trainloader), 'Loss: %.3f | Acc: %.3f%% (%d/%d)'
-                     % (train_loss / (batch_idx + 1), 100. * correct / total, correct, total))
+        metrics.update(loss, preds, label)
 
     time_cost = int((datetime.datetime.now() - time_cost).total_seconds())
-    train_true = np.concatenate(train_true)
-    train_pred = np.concatenate(train_pred)
     return {
-        "loss": float("%.3f" % (train_loss / (batch_idx + 1))),
-        "acc": float("%.3f" % (100. * metrics.accuracy_score(train_true, train_pred))),
-        "acc_avg": float("%.3f" % (100. * metrics.balanced_accuracy_score(train_true, train_pred))),
+        "loss": float("%.3f" % metrics.loss()),
+        "acc": float("%.3f" % (100. * confusion.accuracy())),
+        "acc_avg": float("%.3f" % (100. * confusion.balanced_accuracy())),
         "time": time_cost
     }
 
 
 def validate(net, testloader, criterion, device):
     net.eval()
-    test_loss = 0
-    correct = 0
-    total = 0
-    test_true = []
-    test_pred = []
+    metrics = RunningMetrics(len(testloader))
+    confusion = ConfusionMatrix()
     time_cost = datetime.datetime.now()
     with torch.no_grad():
         for batch_idx, (data, label) in enumerate(testloader):
@@ -245,22 +230,15 @@ def validate(net, testloader, criterion, device):
             data = data.permute(0, 2, 1)
             logits = net(data)
             loss = criterion(logits, label)
-            test_loss += loss.item()
             preds = logits.max(dim=1)[1]
-            test_true.append(label.cpu().numpy())
-            test_pred.append(preds.detach().cpu().numpy())
-            total += label.size(0)
-            correct += preds.eq(label).sum().item()
-            progress_bar(batch_idx, len(testloader), 'Loss: %.3f | Acc: %.3f%% (%d/%d)'
-                         % (test_loss / (batch_idx + 1), 100. * correct / total, correct, total))
+            confusion.update(logits.detach(), label)
+            metrics.update(loss, preds, label)
 
     time_cost = int((datetime.datetime.now() - time_cost).total_seconds())
-    test_true = np.concatenate(test_true)
-    test_pred = np.concatenate(test_pred)
     return {
-        "loss": float("%.3f" % (test_loss / (batch_idx + 1))),
-        "acc": float("%.3f" % (100. * metrics.accuracy_score(test_true, test_pred))),
-        "acc_avg": float("%.3f" % (100. * metrics.balanced_accuracy_score(test_true, test_pred))),
+        "loss": float("%.3f" % metrics.loss()),
+        "acc": float("%.3f" % (100. * confusion.accuracy())),
+        "acc_avg": float("%.3f" % (100. * confusion.balanced_accuracy())),
         "time": time_cost
     }
 
@@ -77,10 +77,91 @@ def local_operator_withnorm(x, norm_plt, k):
     return feature
 
 
-def GDM(x, M):
+def knn_ball(x, k, tau, sigma, block_size=1024):
+    """
+    k nearest neighbors of every point of x [B, C, N], together with the sum of the Gaussian weights of Eq.(2)
+    over its whole tau-ball. The points are streamed in blocks of block_size with a running top-k, so no
+    [B, N, N] tensor is built (peak extra memory [B, N, k + block_size]).
+    Return: idx [B, N, k] nearest first, dist [B, N, k] squared distances, ball_sum [B, N]
+    """
+    num_points = x.size(2)
+    x = x.transpose(2, 1)  # b,n,c
+    xx = torch.sum(x ** 2, dim=-1)  # b,n
+    best_dist, best_idx = None, None
+    ball_sum = torch.zeros_like(xx)
+    for start in range(0, num_points, block_size):
+        block = x[:, start:start + block_size]
+        dist = xx.unsqueeze(-1) - 2 * torch.matmul(x, block.transpose(2, 1)) + xx[:, None, start:start + block_size]
+        mask = torch.sqrt(torch.abs(dist)) < tau
+        ball_sum += torch.mul(mask.float(), torch.exp(-dist / (sigma * sigma))).sum(dim=-1)
+        if best_dist is not None:
+            k_prev = best_dist.shape[-1]
+            dist = torch.cat([best_dist, dist], dim=-1)  # b,n,k+block
+        best_dist, pos = torch.topk(dist, min(k, dist.shape[-1]), dim=-1, largest=False, sorted=False)
+        if best_idx is None:
+            best_idx = pos + start
+        else:
+            # positions < k_prev come from the running top-k, the others from the current block.
+            kept = torch.gather(best_idx, -1, pos.clamp(max=k_prev - 1))
+            best_idx = torch.where(pos < k_prev, kept, pos - k_prev + start)
+    best_dist, order = best_dist.sort(dim=-1)
+    return torch.gather(best_idx, -1, order), best_dist, ball_sum
+
+
+def GDM(x, M, block_size=1024):
     """
     Geometry-Disentangle Module
     M: number of disentangled points in both sharp and gentle variation components
+    The adjacency is kept sparse: A_hat is only evaluated on the kNN of every point ([B, N, k] weights, divided by
+    the tau-ball sums from knn_ball) instead of diag(1 / sum) @ w on a dense [B, N, N] matrix. The selected points
+    are the same as with _GDM_dense; only xs, xg carry gradients, so the selection runs without autograd.
+    """
+    k = 64  # number of neighbors to decide the range of j in Eq.(5)
+    tau = 0.2  # threshold in Eq.(2)
+    sigma = 2  # parameters of f (Gaussian function in Eq.(2))
+    device = x.device
+    batch_size = x.size(0)
+    num_points = x.size(2)
+    x = x.view(batch_size, -1, num_points)
+    _, num_dims, _ = x.size()
+    xt = x.transpose(2, 1).contiguous()  # b,n,c
+
+    with torch.no_grad():
+        """Graph Construction:"""
+        idx, dist, ball_sum = knn_ball(x, k=k, tau=tau, sigma=sigma, block_size=block_size)
+        # Aij in a local area (the nearest neighbor, the point itself, is left out as in Eq.(5)):
+        dist = dist[:, :, 1:k]  # b,n,k-1
+        mask = torch.sqrt(torch.abs(dist)) < tau
+        w = torch.mul(mask.float(), torch.exp(-dist / (sigma * sigma)))
+        A = w * (1 / ball_sum).unsqueeze(-1)  # row-normalized A_hat: b,n,k-1
+        ###############
+        """Disentangling Point Clouds into Sharp(xs) and Gentle(xg) Variation Components:"""
+        idx_base = torch.arange(0, batch_size, device=device).view(-1, 1, 1) * num_points
+        idx = (idx[:, :, 1:k] + idx_base).reshape(-1)
+        neighbor = xt.view(batch_size * num_points, -1)[idx, :]
+        neighbor = neighbor.view(batch_size, num_points, k - 1, num_dims)  # b,n,k,c
+        n = torch.sum(A.unsqueeze(-1).mul(neighbor), dim=2)  # b,n,c
+
+        pai = torch.norm(xt - n, dim=-1).pow(2)  # Eq.(5)
+        pais = pai.topk(k=M, dim=-1)[1]  # first M points as the sharp variation component
+        paig = (-pai).topk(k=M, dim=-1)[1]  # last M points as the gentle variation component
+
+    pai_base = torch.arange(0, batch_size, device=device).view(-1, 1) * num_points
+    indices = (pais + pai_base).view(-1)
+    indiceg = (paig + pai_base).view(-1)
+
+    xs = xt.view(batch_size * num_points, -1)[indices, :]
+    xg = xt.view(batch_size * num_points, -1)[indiceg, :]
+
+    xs = xs.view(batch_size, M, -1)  # b,M,c
+    xg = xg.view(batch_size, M, -1)  # b,M,c
+
+    return xs, xg
+
+
+def _GDM_dense(x, M):
+    """
+    Reference Geometry-Disentangle Module on the dense [B, N, N] adjacency, kept to check and benchmark GDM.
     """
     k = 64  # number of neighbors to decide the range of j in Eq.(5)
     tau = 0.2  # threshold in Eq.(2)
@@ -328,6 +409,55 @@ class GDANET(nn.Module):
 
 
 if __name__ == '__main__':
+    # Benchmark of GDM against the dense reference (memory vs throughput at N = 1k/2k/4k/8k):
+    #     python GDANet.py --batch_size 8 --channels 64
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser('GDM benchmark')
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--channels', type=int, default=64)
+    parser.add_argument('--block_size', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    def run(fn, x, M):
+        if device == 'cuda':
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated() if device == 'cuda' else 0
+        fn(x, M)  # warmup
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            out = fn(x, M)
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        elapsed = (time.perf_counter() - start) / args.repeat
+        peak = (torch.cuda.max_memory_allocated() - base) / 2 ** 20 if device == 'cuda' else float('nan')
+        return out, elapsed, peak
+
+    def same_points(a, b):
+        # the selected sets must match; the order of points with equal pai is unspecified.
+        key = torch.randn(a.shape[-1], device=device, dtype=a.dtype)
+        return bool(torch.equal(a.gather(1, (a @ key).argsort(dim=1).unsqueeze(-1).expand_as(a)),
+                                b.gather(1, (b @ key).argsort(dim=1).unsqueeze(-1).expand_as(b))))
+
+    print(f"==> device: {device}, batch_size: {args.batch_size}, channels: {args.channels}, "
+          f"block_size: {args.block_size}")
+    print("N      M      | dense ms  dense MB | sparse ms  sparse MB | same points")
+    with torch.no_grad():
+        for N in [1024, 2048, 4096, 8192]:
+            M = N // 4
+            x = torch.rand(args.batch_size, args.channels, N, device=device) * 0.05
+            try:
+                dense, dense_t, dense_peak = run(_GDM_dense, x, M)
+            except RuntimeError:  # out of memory
+                dense, dense_t, dense_peak = None, float('nan'), float('nan')
+            sparse, sparse_t, sparse_peak = run(lambda a, m: GDM(a, m, block_size=args.block_size), x, M)
+            same = "n/a" if dense is None else same_points(dense[0], sparse[0]) and same_points(dense[1], sparse[1])
+            print(f"{N:<6} {M:<6} | {dense_t * 1e3:8.2f}  {dense_peak:8.1f} | {sparse_t * 1e3:9.2f}  "
+                  f"{sparse_peak:9.1f} | {same}")
 
     data = torch.rand(10, 3, 1024)
     model = GDANET()
@@ -16,7 +16,7 @@ from einops.layers.torch import Rearrange
 from .pointsformer_utils import get_activation, square_distance, index_points, \
     farthest_point_sample, query_ball_point, knn_point
 
-from pointnet2_ops import pointnet2_utils
+from point_ops import furthest_point_sample
 
 
 class LocalGrouper(nn.Module):
@@ -38,7 +38,7 @@ class LocalGrouper(nn.Module):
         # S = self.groups
         xyz = xyz.contiguous()  # xyz [btach, points, xyz]
         # fps_idx = farthest_point_sample(xyz, self.groups).long()
-        fps_idx = pointnet2_utils.furthest_point_sample(xyz, self.groups).long()  # [B, npoint]
+        fps_idx = furthest_point_sample(xyz, self.groups).long()  # [B, npoint]
         new_xyz = index_points(xyz, fps_idx)  # [B, npoint, 3]
         new_points = index_points(points, fps_idx)  # [B, npoint, d]
 
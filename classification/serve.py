@@ -0,0 +1,234 @@
+"""
+CPU inference server for the classifiers in models/, with dynamic micro-batching.
+Concurrent requests are grouped into one forward pass, up to --max_batch_size clouds or until the oldest
+request has waited --max_latency ms, whichever comes first.
+Usage:
+python serve.py --model model31C --msg 20210818204651 --port 8000
+curl -X POST localhost:8000/predict -d '{"points": [[x, y, z], ...]}'
+Response:
+{"logits": [...], "pred": 3, "batch_size": 8, "timings": {"queue_ms": .., "inference_ms": .., "total_ms": ..}}
+"""
+import argparse
+import os
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import torch
+import models as models
+
+
+def parse_args():
+    """Parameters"""
+    parser = argparse.ArgumentParser('serving')
+    parser.add_argument('-c', '--checkpoint', type=str, metavar='PATH',
+                        help='path to best_checkpoint.pth (default: checkpoints/{model}-{msg}/best_checkpoint.pth)')
+    parser.add_argument('--msg', type=str, help='message after checkpoint')
+    parser.add_argument('--model', default='model31C', help='model name [default: model31C]')
+    parser.add_argument('--host', default='127.0.0.1', type=str)
+    parser.add_argument('--port', default=8000, type=int)
+    parser.add_argument('--max_batch_size', default=32, type=int, help='max point clouds per forward')
+    parser.add_argument('--max_latency', default=10., type=float, help='max time (ms) a request waits for a batch')
+    parser.add_argument('--threads', default=0, type=int, help='torch intra-op threads (0: torch default)')
+    parser.add_argument('--timeout', default=30., type=float, help='max time (s) a request waits for its result')
+    return parser.parse_args()
+
+
+def load_model(model_name, checkpoint_path, device='cpu'):
+    """
+    Build models.__dict__[model_name] and load a checkpoint saved by main.py,
+    stripping the DataParallel "module." prefix.
+    """
+    net = models.__dict__[model_name]()
+    checkpoint = torch.load(checkpoint_path, map_location=torch.device('cpu'))
+    state_dict = checkpoint['net'] if 'net' in checkpoint else checkpoint
+    new_dict = OrderedDict()
+    for k, v in state_dict.items():
+        if k.startswith("module."):
+            k = k[7:]
+        new_dict[k] = v
+    net.load_state_dict(new_dict)
+    net = net.to(device)
+    net.eval()
+    return net
+
+
+class InferenceRequest(object):
+    def __init__(self, points):
+        self.points = points  # [N, 3] float tensor
+        self.arrival = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DynamicBatcher(object):
+    def __init__(self, net, max_batch_size=32, max_latency=10., device='cpu', timeout=30.):
+        """
+        :param max_batch_size: max point clouds per forward
+        :param max_latency: max time (ms) the first request of a batch waits for more requests
+        :param timeout: max time (s) submit waits for the result, e.g. if the batching thread died
+        """
+        self.net = net
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency / 1000.
+        self.timeout = timeout
+        self.device = device
+        self.requests = queue.Queue()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def submit(self, points):
+        """
+        Blocking call from a client thread. points: [N, 3]
+        Raise TimeoutError if no result comes within self.timeout seconds.
+        """
+        if not self.is_alive():
+            raise TimeoutError("the batching thread is not running")
+        request = InferenceRequest(torch.as_tensor(points, dtype=torch.float32))
+        self.requests.put(request)
+        if not request.done.wait(self.timeout):
+            raise TimeoutError("no result within %.1fs" % self.timeout)
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self):
+        try:
+            first = self.requests.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first.arrival + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while self.running:
+            batch = self._collect()
+            # clouds of different sizes cannot be stacked; run one forward per size.
+            groups = OrderedDict()
+            for request in batch:
+                groups.setdefault(request.points.shape[0], []).append(request)
+            for group in groups.values():
+                self._run(group)
+
+    def _run(self, group):
+        start = time.perf_counter()
+        try:
+            data = torch.stack([request.points for request in group], dim=0).to(self.device)
+            with torch.no_grad():
+                logits = self.net(data.permute(0, 2, 1)).cpu()
+            end = time.perf_counter()
+            for request, request_logits in zip(group, logits):
+                request.result = {
+                    "logits": request_logits.tolist(),
+                    "pred": int(request_logits.argmax()),
+                    "batch_size": len(group),
+                    "timings": {
+                        "queue_ms": (start - request.arrival) * 1000.,
+                        "inference_ms": (end - start) * 1000.,
+                        "total_ms": (end - request.arrival) * 1000.
+                    }
+                }
+        except Exception as e:
+            for request in group:
+                request.error = e
+        for request in group:
+            request.done.set()
+
+
+def make_handler(batcher):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, body):
+            body = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                if batcher.is_alive():
+                    self._reply(200, {"status": "ok"})
+                else:
+                    self._reply(503, {"status": "batching thread is not running"})
+            else:
+                self._reply(404, {"error": "unknown path %s" % self.path})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._reply(404, {"error": "unknown path %s" % self.path})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                points = torch.as_tensor(body["points"], dtype=torch.float32)
+                assert points.dim() == 2 and points.shape[1] == 3, "points should be [N, 3]"
+            except (ValueError, KeyError, TypeError, AssertionError) as e:
+                self._reply(400, {"error": str(e)})
+                return
+            try:
+                self._reply(200, batcher.submit(points))
+            except TimeoutError as e:
+                self._reply(503, {"error": str(e)})
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    args = parse_args()
+    print(f"args: {args}")
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    if args.checkpoint is None:
+        message = "" if args.msg is None else "-" + args.msg
+        args.checkpoint = os.path.join('checkpoints', args.model + message, 'best_checkpoint.pth')
+    device = 'cpu'
+    print(f"==> Loading {args.model} from {args.checkpoint} on {device}..")
+    net = load_model(args.model, args.checkpoint, device=device)
+
+    batcher = DynamicBatcher(net, max_batch_size=args.max_batch_size, max_latency=args.max_latency, device=device,
+                             timeout=args.timeout)
+    batcher.start()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher))
+    print(f"==> Serving on http://{args.host}:{args.port}/predict "
+          f"(max_batch_size: {args.max_batch_size}, max_latency: {args.max_latency}ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+
+
+if __name__ == '__main__':
+    main()
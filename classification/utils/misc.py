@@ -20,7 +20,8 @@ import torch.nn.init as init
 from torch.autograd import Variable
 
 __all__ = ['get_mean_and_std', 'init_params', 'mkdir_p', 'AverageMeter',
-           'progress_bar','save_model',"save_args","set_seed", "IOStream", "cal_loss"]
+           'progress_bar','save_model',"save_args","set_seed", "IOStream", "cal_loss", "ConfusionMatrix",
+           "RunningMetrics", "stratified_subset", "stratified_mean"]
 
 
 def get_mean_and_std(dataset):
@@ -83,6 +84,79 @@ class AverageMeter(object):
         self.avg = self.sum / self.count
 
 
+class ConfusionMatrix(object):
+    """Streaming confusion matrix that stays on the device of the logits.
+       Each update is a single index_add_, so there is no host sync per batch;
+       OA, mAcc (sklearn balanced_accuracy_score) and per-class recall can be read at any point.
+    """
+    def __init__(self, num_classes=None):
+        self.num_classes = num_classes
+        self.matrix = None
+
+    def reset(self):
+        self.matrix = None
+
+    def update(self, logits, target):
+        """logits: [B, num_classes] (or predictions [B] if num_classes is given), target: [B]"""
+        if logits.dim() > 1:
+            if self.num_classes is None:
+                self.num_classes = logits.shape[1]
+            preds = logits.max(dim=1)[1]
+        else:
+            preds = logits
+        if self.matrix is None:
+            self.matrix = torch.zeros(self.num_classes, self.num_classes, dtype=torch.long, device=preds.device)
+        index = target.view(-1) * self.num_classes + preds.view(-1)
+        self.matrix.view(-1).index_add_(0, index, torch.ones_like(index))
+
+    def recall(self):
+        """per-class recall, nan for classes absent from the targets"""
+        matrix = self.matrix.double()
+        return matrix.diagonal() / matrix.sum(dim=1)
+
+    def accuracy(self):
+        matrix = self.matrix.double()
+        return (matrix.diagonal().sum() / matrix.sum()).item()
+
+    def balanced_accuracy(self):
+        recall = self.recall()
+        return recall[~torch.isnan(recall)].mean().item()
+
+
+class RunningMetrics(object):
+    """Running loss and correct count of a train/validate loop, summed on the device.
+       update() redraws the progress bar every batch, but reads the values back (one host sync) only every
+       log_interval batches and at the last batch.
+    """
+    def __init__(self, num_batches, log_interval=20):
+        self.num_batches = num_batches
+        self.log_interval = log_interval
+        self.loss_sum = None
+        self.correct = None
+        self.total = 0
+        self.batches = 0
+        self.msg = None
+
+    def update(self, loss, preds, target):
+        correct = preds.eq(target).sum()
+        if self.loss_sum is None:
+            self.loss_sum = loss.detach().double()
+            self.correct = correct
+        else:
+            self.loss_sum += loss.detach()
+            self.correct += correct
+        self.total += target.size(0)
+        self.batches += 1
+        if (self.batches - 1) % self.log_interval == 0 or self.batches == self.num_batches:
+            loss_sum, correct = torch.stack([self.loss_sum, self.correct.double()]).tolist()
+            self.msg = 'Loss: %.3f | Acc: %.3f%% (%d/%d)' % (loss_sum / self.batches, 100. * correct / self.total,
+                                                            correct, self.total)
+        progress_bar(self.batches - 1, self.num_batches, self.msg)
+
+    def loss(self):
+        """mean of the per-batch losses"""
+        return self.loss_sum.item() / self.batches
+
 
 TOTAL_BAR_LENGTH = 65.
 last_time = time.time()
@@ -215,8 +289,9 @@ class IOStream():
         self.f.close()
 
 
-def cal_loss(pred, gold, smoothing=True):
-    ''' Calculate cross entropy loss, apply label smoothing if needed. '''
+def cal_loss(pred, gold, smoothing=True, reduction='mean'):
+    ''' Calculate cross entropy loss, apply label smoothing if needed.
+        reduction='none' returns the per-sample losses. '''
 
     gold = gold.contiguous().view(-1)
 
@@ -228,8 +303,54 @@ def cal_loss(pred, gold, smoothing=True):
         one_hot = one_hot * (1 - eps) + (1 - one_hot) * eps / (n_class - 1)
         log_prb = F.log_softmax(pred, dim=1)
 
-        loss = -(one_hot * log_prb).sum(dim=1).mean()
+        loss = -(one_hot * log_prb).sum(dim=1)
+        if reduction == 'mean':
+            loss = loss.mean()
     else:
-        loss = F.cross_entropy(pred, gold, reduction='mean')
+        loss = F.cross_entropy(pred, gold, reduction=reduction)
 
     return loss
+
+
+def stratified_subset(label, per_class, seed=0):
+    """
+    Fixed stratified subset of a split: min(per_class, class size) samples of every class, drawn with seed.
+    The indices are interleaved class by class (the first sample of every class, then the second, ...),
+    so that every prefix of the subset is itself close to stratified.
+    Return: indices [n] (int64)
+    """
+    label = np.asarray(label).reshape(-1)
+    rng = np.random.RandomState(seed)
+    picks = [rng.permutation(np.flatnonzero(label == c))[:per_class] for c in np.unique(label)]
+    order = [p[r] for r in range(max(len(p) for p in picks)) for p in picks if r < len(p)]
+    return np.array(order, dtype=np.int64)
+
+
+def stratified_mean(values, label, population, z=1.96):
+    """
+    Stratified estimate of the mean of values over the whole split, from the evaluated samples only.
+    values: [K, n] per-sample values of K models, label: [n], population: [num_classes] class sizes of the split.
+    Every class is weighted by its share of the split, and the half-width of the z confidence interval uses the
+    finite population correction, so it is 0 once every sample of the split is evaluated. Classes with a single
+    evaluated sample use the within-class variance pooled over the other classes.
+    Return: (mean [K], half_width [K])
+    """
+    values = values.double()
+    population = population.to(values.device).double()
+    ones = torch.ones_like(label, dtype=torch.float64)
+    count = torch.zeros_like(population).index_add_(0, label, ones)
+    total = torch.zeros(values.shape[0], population.shape[0], dtype=torch.float64, device=values.device)
+    total_sq = total.clone()
+    total.index_add_(1, label, values)
+    total_sq.index_add_(1, label, values * values)
+    class_mean = total / count.clamp(min=1)
+    class_var = ((total_sq - total * class_mean) / (count - 1).clamp(min=1)).clamp(min=0)
+    dof = (count - 1).clamp(min=0)
+    pooled_var = (class_var * dof).sum(dim=1, keepdim=True) / dof.sum().clamp(min=1)
+    class_var = torch.where(count == 1, pooled_var, class_var)
+    weight = population * (count > 0)  # classes not reached yet are left out of the estimate
+    weight = weight / weight.sum()
+    fpc = (1 - count / population.clamp(min=1)).clamp(min=0)
+    mean = (weight * class_mean).sum(dim=1)
+    var = (weight * weight * class_var * fpc / count.clamp(min=1)).sum(dim=1)
+    return mean, z * var.sqrt()
@@ -4,6 +4,7 @@ nohup python voting.py --model model31A --msg 20210818204651 > model31A_20210818
 import argparse
 import os
 import datetime
+import math
 import torch
 import torch.nn.parallel
 import torch.backends.cudnn as cudnn
@@ -12,9 +13,9 @@ import torch.utils.data
 import torch.utils.data.distributed
 from torch.utils.data import DataLoader
 import models as models
-from utils import progress_bar, IOStream
+from models.neighbor_cache import enable_neighbor_cache, neighbor_cache_key
+from utils import progress_bar, IOStream, ConfusionMatrix, RunningMetrics
 from data import ModelNet40
-import sklearn.metrics as metrics
 from helper import cal_loss
 import numpy as np
 import torch.nn.functional as F
@@ -41,23 +42,94 @@ def parse_args():
     # Voting evaluation, referring: https://github.com/CVMI-Lab/PAConv/blob/main/obj_cls/eval_voting.py
     parser.add_argument('--NUM_PEPEAT', type=int, default=300)
     parser.add_argument('--NUM_VOTE', type=int, default=10)
+    parser.add_argument('--vote_chunk', type=int, default=256, help='max point clouds per stacked voting forward')
+    parser.add_argument('--neighbor_cache', default='none', choices=['none', 'scale'],
+                        help='reuse fps/knn indices over repeats; "scale" ignores the voting scales (approximate)')
+    parser.add_argument('--compound_scale', action='store_true',
+                        help='compound the scales over votes, as the earlier per-vote loop did')
 
     parser.add_argument('--validate', action='store_true', help='Validate the original testing result.')
     return parser.parse_args()
 
 
-class PointcloudScale(object): # input random scaling
-    def __init__(self, scale_low=2. / 3., scale_high=3. / 2.):
+class PointcloudScale(object): # input random scaling, all votes of a batch at once
+    def __init__(self, scale_low=2. / 3., scale_high=3. / 2., compound=False):
+        """
+        Generates per-sample, per-axis scales on the data's device.
+        :param compound: reproduce the legacy behaviour, where vote v re-scaled the (aliased) output of vote v-1,
+                         i.e. the scales are cumulative products over the votes.
+        """
         self.scale_low = scale_low
         self.scale_high = scale_high
+        self.compound = compound
+
+    def __call__(self, num_vote, batch_size, device, generator=None):
+        """
+        Return scales [num_vote, batch_size, 1, 3]; vote 0 is always the un-scaled input.
+        """
+        scales = torch.empty(num_vote, batch_size, 1, 3, device=device).uniform_(
+            self.scale_low, self.scale_high, generator=generator)
+        scales[0] = 1.
+        if self.compound:
+            scales = torch.cumprod(scales, dim=0)
+        return scales
+
+
+def vote_batch(net, data, scales, chunk_size=256, cache_key=None):
+    """
+    Stack all votes of one batch into [V*B, 3, N] forwards (chunked to at most chunk_size clouds per forward)
+    and return the averaged softmax [B, num_classes].
+    :param data: [B, N, 3] on device
+    :param scales: [V, B, 1, 3] on device
+    :param cache_key: identifies data for the neighbor cache (if enabled), e.g. the batch index
+    """
+    num_vote, batch_size = scales.shape[0], data.shape[0]
+    votes_per_chunk = max(1, chunk_size // batch_size)
+    pred = None
+    with torch.no_grad():
+        for v in range(0, num_vote, votes_per_chunk):
+            chunk = scales[v:v + votes_per_chunk]
+            new_data = (data.unsqueeze(0) * chunk).view(-1, data.shape[1], data.shape[2])  # [v*B, N, 3]
+            with neighbor_cache_key(net, None if cache_key is None else (cache_key, v)):
+                logits = net(new_data.permute(0, 2, 1))
+            prob = F.softmax(logits, dim=1).view(chunk.shape[0], batch_size, -1)
+            if pred is None:
+                pred = prob.sum(dim=0)
+            else:
+                pred.add_(prob.sum(dim=0))
+    pred.div_(num_vote)
+    return pred
+
+
+def voting_engine(net, testloader, device, num_repeat=300, num_vote=10, pointscale=None, seed=None,
+                  chunk_size=256, callback=None):
+    """
+    Multi-vote TTA evaluation. The test set is moved to the device once and reused by every repeat;
+    scales are drawn on-device from a generator seeded with `seed`, so results are reproducible.
+    Return: a list (one entry per repeat) of {"acc", "acc_avg"} in percentage.
+    """
+    if pointscale is None:
+        pointscale = PointcloudScale(scale_low=0.85, scale_high=1.15)
+    generator = torch.Generator(device=device)
+    if seed is not None:
+        generator.manual_seed(seed)
+    net.eval()
+    batches = [(data.to(device), label.to(device).view(-1)) for data, label in testloader]
+    results = []
+    for i in range(num_repeat):
+        confusion = ConfusionMatrix()
+        for batch_idx, (data, label) in enumerate(batches):
+            scales = pointscale(num_vote, data.shape[0], data.device, generator)
+            confusion.update(vote_batch(net, data, scales, chunk_size, cache_key=batch_idx), label)
+        out = {
+            "acc": 100. * confusion.accuracy(),
+            "acc_avg": 100. * confusion.balanced_accuracy()
+        }
+        results.append(out)
+        if callback is not None:
+            callback(i, out)
+    return results
 
-    def __call__(self, pc):
-        bsize = pc.size()[0]
-        for i in range(bsize):
-            xyz1 = np.random.uniform(low=self.scale_low, high=self.scale_high, size=[3])
-            pc[i, :, 0:3] = torch.mul(pc[i, :, 0:3], torch.from_numpy(xyz1).float().cuda())
-
-        return pc
 
 def main():
     args = parse_args()
@@ -119,11 +191,8 @@ def main():
 
 def validate(net, testloader, criterion, device):
     net.eval()
-    test_loss = 0
-    correct = 0
-    total = 0
-    test_true = []
-    test_pred = []
+    metrics = RunningMetrics(len(testloader))
+    confusion = ConfusionMatrix()
     time_cost = datetime.datetime.now()
     with torch.no_grad():
         for batch_idx, (data, label) in enumerate(testloader):
@@ -131,22 +200,15 @@ def validate(net, testloader, criterion, device):
             data = data.permute(0, 2, 1)
             logits = net(data)
             loss = criterion(logits, label)
-            test_loss += loss.item()
             preds = logits.max(dim=1)[1]
-            test_true.append(label.cpu().numpy())
-            test_pred.append(preds.detach().cpu().numpy())
-            total += label.size(0)
-            correct += preds.eq(label).sum().item()
-            progress_bar(batch_idx, len(testloader), 'Loss: %.3f | Acc: %.3f%% (%d/%d)'
-                         % (test_loss / (batch_idx + 1), 100. * correct / total, correct, total))
+            confusion.update(logits.detach(), label)
+            metrics.update(loss, preds, label)
 
     time_cost = int((datetime.datetime.now() - time_cost).total_seconds())
-    test_true = np.concatenate(test_true)
-    test_pred = np.concatenate(test_pred)
     return {
-        "loss": float("%.3f" % (test_loss / (batch_idx + 1))),
-        "acc": float("%.3f" % (100. * metrics.accuracy_score(test_true, test_pred))),
-        "acc_avg": float("%.3f" % (100. * metrics.balanced_accuracy_score(test_true, test_pred))),
+        "loss": float("%.3f" % metrics.loss()),
+        "acc": float("%.3f" % (100. * confusion.accuracy())),
+        "acc_avg": float("%.3f" % (100. * confusion.balanced_accuracy())),
         "time": time_cost
     }
 
@@ -156,54 +218,35 @@ def voting(net, testloader, device, args):
     io = IOStream(args.checkpoint + name)
     io.cprint(str(args))
 
-
-    net.eval()
-    best_acc = 0
-    best_mean_acc = 0
+    best = {"acc": 0, "acc_avg": 0}
     # pointscale = PointcloudScale(scale_low=0.8, scale_high=1.18)  # set the range of scaling
     # pointscale = PointcloudScale()
-    pointscale = PointcloudScale(scale_low=0.85, scale_high=1.15)
-
-    for i in range(args.NUM_PEPEAT):
-        test_true = []
-        test_pred = []
+    pointscale = PointcloudScale(scale_low=0.85, scale_high=1.15, compound=args.compound_scale)
 
-        for batch_idx, (data, label) in enumerate(testloader):
-            data, label = data.to(device), label.to(device).squeeze()
-            pred = 0
-            for v in range(args.NUM_VOTE):
-                new_data = data
-                # batch_size = data.size()[0]
-                if v > 0:
-                    new_data.data = pointscale(new_data.data)
-                with torch.no_grad():
-                    pred += F.softmax(net(new_data.permute(0, 2, 1)), dim=1)  # sum 10 preds
-            pred /= args.NUM_VOTE  # avg the preds!
-            label = label.view(-1)
-            pred_choice = pred.max(dim=1)[1]
-            test_true.append(label.cpu().numpy())
-            test_pred.append(pred_choice.detach().cpu().numpy())
-        test_true = np.concatenate(test_true)
-        test_pred = np.concatenate(test_pred)
-        test_acc = 100. * metrics.accuracy_score(test_true, test_pred)
-        test_mean_acc = 100. * metrics.balanced_accuracy_score(test_true, test_pred)
-        if test_acc > best_acc:
-            best_acc = test_acc
-        if test_mean_acc > best_mean_acc:
-            best_mean_acc = test_mean_acc
+    def log_repeat(i, out):
+        best["acc"] = max(best["acc"], out["acc"])
+        best["acc_avg"] = max(best["acc_avg"], out["acc_avg"])
         outstr = 'Voting %d, test acc: %.3f, test mean acc: %.3f,  [current best(all_acc: %.3f mean_acc: %.3f)]' % \
-                 (i, test_acc, test_mean_acc, best_acc, best_mean_acc)
+                 (i, out["acc"], out["acc_avg"], best["acc"], best["acc_avg"])
         io.cprint(outstr)
 
-    final_outstr = 'Final voting test acc: %.6f,' % (best_acc)
+    caches = []
+    if args.neighbor_cache != 'none':
+        # one entry per stacked forward of a repeat and per DataParallel replica (the key holds the replica's
+        # device), every one of them is revisited by the next repeat.
+        votes_per_chunk = max(1, args.vote_chunk // testloader.batch_size)
+        replicas = len(net.device_ids) if isinstance(net, torch.nn.DataParallel) else 1
+        caches = enable_neighbor_cache(
+            net, max_entries=len(testloader) * math.ceil(args.NUM_VOTE / votes_per_chunk) * replicas)
+
+    voting_engine(net, testloader, device, num_repeat=args.NUM_PEPEAT, num_vote=args.NUM_VOTE,
+                  pointscale=pointscale, seed=args.seed, chunk_size=args.vote_chunk, callback=log_repeat)
+
+    if caches:
+        io.cprint('Neighbor cache hits: %d, misses: %d' % (sum(c.hits for c in caches), sum(c.misses for c in caches)))
+    final_outstr = 'Final voting test acc: %.6f,' % (best["acc"])
     io.cprint(final_outstr)
 
 
-
-
-
-
-
-
 if __name__ == '__main__':
     main()
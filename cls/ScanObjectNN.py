@@ -7,17 +7,38 @@ import sys
 import glob
 import h5py
 import numpy as np
+import torch
 from torch.utils.data import Dataset
 
 os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
 
 
-def load_scanobjectnn_data(partition):
+# variant name -> (folder in data/h5_files, file suffix); the _nobg folder holds the same splits without background.
+SCANOBJECTNN_VARIANTS = {
+    'OBJ_BG': ('main_split', 'objectdataset'),
+    'OBJ_ONLY': ('main_split_nobg', 'objectdataset'),
+    'PB_T25': ('main_split', 'objectdataset_augmented25_norot'),
+    'PB_T25_R': ('main_split', 'objectdataset_augmented25rot'),
+    'PB_T50_R': ('main_split', 'objectdataset_augmentedrot'),
+    'PB_T50_RS': ('main_split', 'objectdataset_augmentedrot_scale75'),
+    'PB_T25_nobg': ('main_split_nobg', 'objectdataset_augmented25_norot'),
+    'PB_T25_R_nobg': ('main_split_nobg', 'objectdataset_augmented25rot'),
+    'PB_T50_R_nobg': ('main_split_nobg', 'objectdataset_augmentedrot'),
+    'PB_T50_RS_nobg': ('main_split_nobg', 'objectdataset_augmentedrot_scale75'),
+}
+
+
+def scanobjectnn_h5_path(partition, variant='PB_T50_RS'):
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    folder, suffix = SCANOBJECTNN_VARIANTS[variant]
+    return os.path.join(BASE_DIR, 'data', 'h5_files', folder, '%s_%s.h5' % (partition, suffix))
+
+
+def load_scanobjectnn_data(partition, variant='PB_T50_RS'):
     all_data = []
     all_label = []
 
-    h5_name = BASE_DIR + '/data/h5_files/main_split/' + partition + '_objectdataset_augmentedrot_scale75.h5'
+    h5_name = scanobjectnn_h5_path(partition, variant)
     f = h5py.File(h5_name, mode="r")
     data = f['data'][:].astype('float32')
     label = f['label'][:].astype('int64')
@@ -29,6 +50,20 @@ def load_scanobjectnn_data(partition):
     return all_data, all_label
 
 
+def iterate_scanobjectnn_data(partition, variant='PB_T50_RS', chunk_size=1024, num_points=None):
+    """
+    Stream one split from its h5 file in chunks of chunk_size clouds, so memory stays bounded by one chunk
+    (whole datasets are never read into RAM).
+    Yield: data [chunk, num_points, 3] float32, label [chunk] int64
+    """
+    with h5py.File(scanobjectnn_h5_path(partition, variant), mode="r") as f:
+        data, label = f['data'], f['label']
+        num_points = data.shape[1] if num_points is None else num_points
+        for start in range(0, data.shape[0], chunk_size):
+            end = min(start + chunk_size, data.shape[0])
+            yield data[start:end, :num_points].astype('float32'), label[start:end].reshape(-1).astype('int64')
+
+
 def translate_pointcloud(pointcloud):
     xyz1 = np.random.uniform(low=2. / 3., high=3. / 2., size=[3])
     xyz2 = np.random.uniform(low=-0.2, high=0.2, size=[3])
@@ -37,16 +72,59 @@ def translate_pointcloud(pointcloud):
     return translated_pointcloud
 
 
+class BatchTranslateShuffle(object):
+    """
+    Batched version of translate_pointcloud + np.random.shuffle for a [B, N, 3] tensor (after .to(device)).
+    Every sample still draws its own anisotropic scale, shift and point permutation. The draws come from a
+    torch.Generator on the data's device, seeded once, so a run is reproducible from its seed.
+    Works on both cuda and cpu tensors.
+    """
+    def __init__(self, scale_low=2. / 3., scale_high=3. / 2., shift_range=0.2, shuffle=True, seed=None):
+        self.scale_low = scale_low
+        self.scale_high = scale_high
+        self.shift_range = shift_range
+        self.shuffle = shuffle
+        self.seed = seed
+        self.generators = {}
+
+    def _generator(self, device):
+        key = str(device)
+        if key not in self.generators:
+            generator = torch.Generator(device=device)
+            if self.seed is not None:
+                generator.manual_seed(self.seed)
+            else:
+                generator.seed()
+            self.generators[key] = generator
+        return self.generators[key]
+
+    def __call__(self, pc):
+        B, N, C = pc.shape
+        generator = self._generator(pc.device)
+        xyz1 = torch.empty(B, 1, C, device=pc.device, dtype=pc.dtype).uniform_(
+            self.scale_low, self.scale_high, generator=generator)
+        xyz2 = torch.empty(B, 1, C, device=pc.device, dtype=pc.dtype).uniform_(
+            -self.shift_range, self.shift_range, generator=generator)
+        pc = torch.addcmul(xyz2, pc, xyz1)
+        if self.shuffle:
+            # argsort of i.i.d. uniforms is a uniform random permutation, drawn independently per sample.
+            perm = torch.rand(B, N, device=pc.device, generator=generator).argsort(dim=1)
+            pc = torch.gather(pc, 1, perm.unsqueeze(-1).expand(-1, -1, C))
+        return pc
+
+
 class ScanObjectNN(Dataset):
-    def __init__(self, num_points, partition='training'):
-        self.data, self.label = load_scanobjectnn_data(partition)
+    def __init__(self, num_points, partition='training', augment=True, variant='PB_T50_RS'):
+        self.data, self.label = load_scanobjectnn_data(partition, variant)
         self.num_points = num_points
         self.partition = partition
+        # set augment=False when the batch is augmented on device with BatchTranslateShuffle instead.
+        self.augment = augment
 
     def __getitem__(self, item):
         pointcloud = self.data[item][:self.num_points]
         label = self.label[item]
-        if self.partition == 'training':
+        if self.partition == 'training' and self.augment:
             pointcloud = translate_pointcloud(pointcloud)
             np.random.shuffle(pointcloud)
         return pointcloud, label
@@ -0,0 +1,155 @@
+"""
+Evaluate one checkpoint on several ScanObjectNN variants in a single process.
+The model is loaded once; every split is streamed from its h5 file in chunks (the next chunk is read while the
+current one is on the GPU), so memory stays bounded whatever the split size.
+Writes one JSON with per-split OA, mAcc, per-class recall, loss and timings.
+Usage:
+python eval_splits.py --model model31C --msg demo
+python eval_splits.py --model model31C --msg demo --variants OBJ_BG OBJ_ONLY PB_T50_RS --output splits.json
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import torch
+import torch.backends.cudnn as cudnn
+import models as models
+from utils import cal_loss, ConfusionMatrix
+from ScanObjectNN import SCANOBJECTNN_VARIANTS, scanobjectnn_h5_path, iterate_scanobjectnn_data
+
+
+def parse_args():
+    """Parameters"""
+    parser = argparse.ArgumentParser('evaluating')
+    parser.add_argument('-c', '--checkpoint', type=str, metavar='PATH',
+                        help='path to best_checkpoint.pth (default: checkpoints/{model}-{msg}/best_checkpoint.pth)')
+    parser.add_argument('--msg', type=str, help='message after checkpoint')
+    parser.add_argument('--model', default='PointNet', help='model name [default: pointnet_cls]')
+    parser.add_argument('--num_classes', default=15, type=int, help='default value for classes of ScanObjectNN')
+    parser.add_argument('--num_points', type=int, default=1024, help='Point Number')
+    parser.add_argument('--batch_size', type=int, default=32, help='batch size in testing')
+    parser.add_argument('--chunk_size', type=int, default=1024, help='clouds read from the h5 file at a time')
+    parser.add_argument('--variants', nargs='+', default=['OBJ_BG', 'OBJ_ONLY', 'PB_T50_RS', 'PB_T50_RS_nobg'],
+                        choices=list(SCANOBJECTNN_VARIANTS.keys()), help='ScanObjectNN variants to evaluate')
+    parser.add_argument('--partition', default='test', help='h5 partition of every variant')
+    parser.add_argument('--output', type=str, help='json path (default: checkpoint folder/splits-{time}.json)')
+    return parser.parse_args()
+
+
+def load_model(model_name, checkpoint_path, num_classes, device):
+    net = models.__dict__[model_name](num_classes=num_classes)
+    checkpoint = torch.load(checkpoint_path, map_location=torch.device('cpu'))
+    new_dict = OrderedDict()
+    for k, v in checkpoint['net'].items():
+        new_dict[k[7:] if k.startswith("module.") else k] = v
+    net.load_state_dict(new_dict)
+    net = net.to(device)
+    net.eval()
+    return net
+
+
+def evaluate_split(net, partition, variant, args, device):
+    """
+    Stream one split through net. The loss and the confusion matrix stay on the device until the split is done.
+    """
+    confusion = ConfusionMatrix(args.num_classes)
+    loss_sum = torch.zeros((), dtype=torch.float64, device=device)
+    count = 0
+    read_time = 0.
+    start = time.perf_counter()
+    chunks = iterate_scanobjectnn_data(partition, variant, chunk_size=args.chunk_size, num_points=args.num_points)
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    def read_next():
+        read_start = time.perf_counter()
+        chunk = next(chunks, None)
+        return chunk, time.perf_counter() - read_start
+
+    try:
+        future = executor.submit(read_next)
+        with torch.no_grad():
+            while True:
+                chunk, chunk_time = future.result()
+                read_time += chunk_time
+                if chunk is None:
+                    break
+                future = executor.submit(read_next)  # read the next chunk while this one is evaluated
+                data, label = torch.from_numpy(chunk[0]), torch.from_numpy(chunk[1])
+                if device == 'cuda':
+                    data, label = data.pin_memory(), label.pin_memory()
+                for s in range(0, data.shape[0], args.batch_size):
+                    batch = data[s:s + args.batch_size].to(device, non_blocking=True).permute(0, 2, 1)
+                    target = label[s:s + args.batch_size].to(device, non_blocking=True)
+                    logits = net(batch)
+                    loss_sum += cal_loss(logits, target).double() * target.shape[0]
+                    confusion.update(logits, target)
+                    count += target.shape[0]
+    finally:
+        executor.shutdown()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    total_time = time.perf_counter() - start
+    return {
+        "h5": scanobjectnn_h5_path(partition, variant),
+        "num_samples": count,
+        "loss": float("%.3f" % (loss_sum.item() / count)),
+        "acc": float("%.3f" % (100. * confusion.accuracy())),
+        "acc_avg": float("%.3f" % (100. * confusion.balanced_accuracy())),
+        "class_acc": [float("%.3f" % (100. * r)) for r in confusion.recall().tolist()],
+        "read_s": read_time,
+        "total_s": total_time,
+        "samples_per_sec": count / total_time
+    }
+
+
+def main():
+    args = parse_args()
+    os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if device == 'cuda':
+        cudnn.benchmark = True
+    if args.checkpoint is None:
+        message = "" if args.msg is None else "-" + args.msg
+        args.checkpoint = os.path.join('checkpoints', args.model + message, 'best_checkpoint.pth')
+    if args.output is None:
+        args.output = os.path.join(os.path.dirname(args.checkpoint),
+                                   'splits' + str(datetime.datetime.now().strftime('-%Y%m%d%H%M%S')) + '.json')
+    print(f"args: {args}")
+
+    print(f"==> Loading {args.model} from {args.checkpoint} on {device}..")
+    load_start = time.perf_counter()
+    net = load_model(args.model, args.checkpoint, args.num_classes, device)
+    report = {
+        "model": args.model,
+        "checkpoint": args.checkpoint,
+        "env": {
+            "torch": torch.__version__,
+            "device": torch.cuda.get_device_name() if device == 'cuda' else 'cpu',
+            "batch_size": args.batch_size,
+            "num_points": args.num_points,
+            "time": str(datetime.datetime.now())
+        },
+        "load_model_s": time.perf_counter() - load_start,
+        "splits": OrderedDict()
+    }
+    for variant in args.variants:
+        try:
+            result = evaluate_split(net, args.partition, variant, args, device)
+        except (OSError, KeyError) as e:  # e.g. a variant that was not downloaded, keep going with the others
+            result = {"error": str(e).split('\n')[0]}
+            print(f"{variant}: {result['error']}")
+        else:
+            print(f"{variant}: acc {result['acc']:.3f} | acc_avg {result['acc_avg']:.3f} | loss {result['loss']:.3f} | "
+                  f"{result['num_samples']} samples in {result['total_s']:.1f}s (read {result['read_s']:.1f}s)")
+        report["splits"][variant] = result
+        # flush after every split, so a crash keeps the finished ones.
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(f"==> Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -20,7 +20,8 @@ import torch.nn.init as init
 from torch.autograd import Variable
 
 __all__ = ['get_mean_and_std', 'init_params', 'mkdir_p', 'AverageMeter',
-           'progress_bar','save_model',"save_args","set_seed", "IOStream", "cal_loss"]
+           'progress_bar','save_model',"save_args","set_seed", "IOStream", "cal_loss", "ConfusionMatrix",
+           "RunningMetrics"]
 
 
 def get_mean_and_std(dataset):
@@ -83,6 +84,79 @@ class AverageMeter(object):
         self.avg = self.sum / self.count
 
 
+class ConfusionMatrix(object):
+    """Streaming confusion matrix that stays on the device of the logits.
+       Each update is a single index_add_, so there is no host sync per batch;
+       OA, mAcc (sklearn balanced_accuracy_score) and per-class recall can be read at any point.
+    """
+    def __init__(self, num_classes=None):
+        self.num_classes = num_classes
+        self.matrix = None
+
+    def reset(self):
+        self.matrix = None
+
+    def update(self, logits, target):
+        """logits: [B, num_classes] (or predictions [B] if num_classes is given), target: [B]"""
+        if logits.dim() > 1:
+            if self.num_classes is None:
+                self.num_classes = logits.shape[1]
+            preds = logits.max(dim=1)[1]
+        else:
+            preds = logits
+        if self.matrix is None:
+            self.matrix = torch.zeros(self.num_classes, self.num_classes, dtype=torch.long, device=preds.device)
+        index = target.view(-1) * self.num_classes + preds.view(-1)
+        self.matrix.view(-1).index_add_(0, index, torch.ones_like(index))
+
+    def recall(self):
+        """per-class recall, nan for classes absent from the targets"""
+        matrix = self.matrix.double()
+        return matrix.diagonal() / matrix.sum(dim=1)
+
+    def accuracy(self):
+        matrix = self.matrix.double()
+        return (matrix.diagonal().sum() / matrix.sum()).item()
+
+    def balanced_accuracy(self):
+        recall = self.recall()
+        return recall[~torch.isnan(recall)].mean().item()
+
+
+class RunningMetrics(object):
+    """Running loss and correct count of a train/validate loop, summed on the device.
+       update() redraws the progress bar every batch, but reads the values back (one host sync) only every
+       log_interval batches and at the last batch.
+    """
+    def __init__(self, num_batches, log_interval=20):
+        self.num_batches = num_batches
+        self.log_interval = log_interval
+        self.loss_sum = None
+        self.correct = None
+        self.total = 0
+        self.batches = 0
+        self.msg = None
+
+    def update(self, loss, preds, target):
+        correct = preds.eq(target).sum()
+        if self.loss_sum is None:
+            self.loss_sum = loss.detach().double()
+            self.correct = correct
+        else:
+            self.loss_sum += loss.detach()
+            self.correct += correct
+        self.total += target.size(0)
+        self.batches += 1
+        if (self.batches - 1) % self.log_interval == 0 or self.batches == self.num_batches:
+            loss_sum, correct = torch.stack([self.loss_sum, self.correct.double()]).tolist()
+            self.msg = 'Loss: %.3f | Acc: %.3f%% (%d/%d)' % (loss_sum / self.batches, 100. * correct / self.total,
+                                                            correct, self.total)
+        progress_bar(self.batches - 1, self.num_batches, self.msg)
+
+    def loss(self):
+        """mean of the per-batch losses"""
+        return self.loss_sum.item() / self.batches
+
 
 TOTAL_BAR_LENGTH = 65.
 last_time = time.time()
@@ -0,0 +1,147 @@
+"""
+Inference-only fusion for the PointMLP family (classification model31/32/33/elite, partseg_v2 pointMLP40,
+scene_seg pointMLP31).
+- BatchNorm1d following a Conv1d/Linear inside a nn.Sequential (ConvBNReLU1D, ConvBNReLURes1D, classifier heads)
+  is folded into the conv/linear weights and replaced by nn.Identity.
+- The LocalGrouper affine (affine_alpha * x + affine_beta) is folded into the first conv of the paired
+  PreExtraction.transfer, and the grouper skips the affine afterwards.
+Shared by all projects, installed with point_ops (`pip install -e .` from the repository root).
+Usage:
+    fused = fuse_model(net)                             # eval-mode copy, net is left untouched
+    print(check_fused(net, fused, data))                # max abs difference of the outputs
+    print(benchmark_fused(net, fused, x, norm_plt, cls_label))   # any model inputs: (diff, net ms, fused ms)
+"""
+import copy
+import time
+import torch
+import torch.nn as nn
+
+
+def _unwrap(net):
+    return net.module if isinstance(net, nn.DataParallel) else net
+
+
+@torch.no_grad()
+def fold_bn(layer, bn):
+    """
+    Fold bn (eval statistics) into layer (nn.Conv1d or nn.Linear) in place.
+    """
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps) if bn.affine else \
+        1. / torch.sqrt(bn.running_var + bn.eps)
+    shift = bn.bias - bn.running_mean * scale if bn.affine else -bn.running_mean * scale
+    layer.weight.mul_(scale.view([-1] + [1] * (layer.weight.dim() - 1)))
+    if layer.bias is None:
+        layer.bias = nn.Parameter(shift.clone())
+    else:
+        layer.bias.mul_(scale).add_(shift)
+
+
+def fuse_bn(module):
+    """
+    Recursively fold every Conv1d/Linear -> BatchNorm1d pair found in nn.Sequential containers.
+    Return the number of folded BatchNorm layers.
+    """
+    count = 0
+    for child in module.children():
+        if isinstance(child, nn.Sequential):
+            for i in range(len(child) - 1):
+                layer, bn = child[i], child[i + 1]
+                if isinstance(layer, (nn.Conv1d, nn.Linear)) and isinstance(bn, nn.BatchNorm1d) \
+                        and bn.track_running_stats:
+                    fold_bn(layer, bn)
+                    child[i + 1] = nn.Identity()
+                    count += 1
+        count += fuse_bn(child)
+    return count
+
+
+@torch.no_grad()
+def fold_affine(grouper, conv):
+    """
+    grouper outputs [alpha * g + beta, p] on the channel dim, which conv (kernel size 1) consumes:
+        W [alpha * g + beta; p] = (W_g * alpha) g + W_g beta + W_p p
+    Fold alpha/beta into conv in place and remove them from the grouper.
+    """
+    alpha = grouper.affine_alpha.view(-1)
+    beta = grouper.affine_beta.view(-1)
+    channels = alpha.shape[0]
+    weight = conv.weight  # [out, in, 1]
+    bias = torch.matmul(weight[:, :channels, 0], beta)
+    weight[:, :channels, :].mul_(alpha.view(1, -1, 1))
+    if conv.bias is None:
+        conv.bias = nn.Parameter(bias)
+    else:
+        conv.bias.add_(bias)
+    grouper.affine_alpha = None
+    grouper.affine_beta = None
+
+
+def fuse_affine(net):
+    """
+    Fold the affine of local_grouper_list[i] into pre_blocks_list[i].transfer. Return the number of folded stages.
+    """
+    count = 0
+    groupers = getattr(net, "local_grouper_list", [])
+    pre_blocks = getattr(net, "pre_blocks_list", [])
+    for grouper, pre_block in zip(groupers, pre_blocks):
+        if getattr(grouper, "affine_alpha", None) is None or not hasattr(pre_block, "transfer"):
+            continue
+        conv = pre_block.transfer.net[0]
+        if not isinstance(conv, nn.Conv1d) or conv.kernel_size[0] != 1 or conv.groups != 1:
+            continue
+        fold_affine(grouper, conv)
+        count += 1
+    return count
+
+
+def fuse_model(net, inplace=False):
+    """
+    Return an eval-mode, inference-only copy of net with the affine and BatchNorm layers folded.
+    """
+    net = _unwrap(net)
+    fused = net if inplace else copy.deepcopy(net)
+    fused.eval()
+    # the affine has to go first: it folds into the raw conv weights, before the BN scale is applied.
+    fuse_affine(fused)
+    fuse_bn(fused)
+    return fused
+
+
+@torch.no_grad()
+def check_fused(net, fused, *inputs, seed=0):
+    """
+    inputs: model inputs, e.g. [B, 3, N]. Return the max abs difference between the outputs of net and fused.
+    Both forwards start from the same RNG state, as some groupers sample at eval time too (e.g. model33).
+    """
+    net.eval()
+    fused.eval()
+    outputs = []
+    for model in [net, fused]:
+        with torch.random.fork_rng():
+            torch.manual_seed(seed)
+            outputs.append(model(*inputs))
+    return (outputs[0] - outputs[1]).abs().max().item()
+
+
+@torch.no_grad()
+def time_forward(net, *inputs, repeat=20):
+    """mean forward time (ms) over repeat passes, after 3 warmup passes"""
+    cuda = inputs[0].is_cuda
+    for _ in range(3):
+        net(*inputs)
+    if cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        net(*inputs)
+    if cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat * 1000.
+
+
+def benchmark_fused(net, fused, *inputs, repeat=20):
+    """
+    Return (max abs diff, net ms, fused ms) on the device of inputs.
+    """
+    diff = check_fused(net, fused, *inputs)
+    return diff, time_forward(net, *inputs, repeat=repeat), time_forward(fused, *inputs, repeat=repeat)
@@ -59,15 +59,15 @@ class Walk(nn.Module):
                         bias=False), nn.BatchNorm1d(2))
 
     def crossover_suppression(self, cur, neighbor, bn, n, k):
-        # cur: bs*n, 3
-        # neighbor: bs*n, 3, k
+        # cur: bs*n, c
+        # neighbor: bs*n, k, c
         neighbor = neighbor.detach()
         cur = cur.unsqueeze(-1).detach()
-        dot = torch.bmm(cur.transpose(1,2), neighbor) # bs*n, 1, k
-        norm1 = torch.norm(cur, dim=1, keepdim=True)
-        norm2 = torch.norm(neighbor, dim=1, keepdim=True)
+        dot = torch.bmm(neighbor, cur).squeeze(-1) # bs*n, k
+        norm1 = torch.norm(cur, dim=1) # bs*n, 1
+        norm2 = torch.norm(neighbor, dim=-1) # bs*n, k
         divider = torch.clamp(norm1 * norm2, min=1e-8)
-        ans = torch.div(dot, divider).squeeze() # bs*n, k
+        ans = torch.div(dot, divider) # bs*n, k
 
         # normalize to [0, 1]
         ans = 1. + ans
@@ -75,9 +75,84 @@ class Walk(nn.Module):
 
         return ans.detach()
 
+    def walk_step(self, flatten_x, flatten_logit, tmp_adj, flatten_cur, pre_feature, cur_feature):
+        """
+        One walking step for all curves: gather the k neighbors of the current points once, score them with
+        agent_mlp, suppress crossovers and pick the next point.
+        flatten_x: bs*n_points, c; flatten_logit: bs*n_points (neighbor half of agent_mlp, see forward)
+        flatten_cur: bs*n current points; pre_feature: bs*n, c curve descriptors; cur_feature: bs*n, c or None
+        Return: cur_feature (bs*n, c) and flatten_cur (bs*n) of the picked points
+        """
+        pick_idx = tmp_adj[flatten_cur] # bs*n, k
+        pick_values = flatten_x[pick_idx] # bs*n, k, c
+
+        # which node to pick next? agent_mlp on [neighbor, curve descriptor], as two projections
+        w_descriptor = self.agent_mlp[0].weight.view(2, -1)[1]
+        logits = flatten_logit[pick_idx] + torch.mv(pre_feature, w_descriptor).unsqueeze(-1) # bs*n, k
+        logits = self.agent_mlp[1](logits.view(-1, 1, self.curve_num, self.k)) # bs, 1, n, k
+
+        if cur_feature is not None:
+            # cross over supression
+            d = self.crossover_suppression(cur_feature - pre_feature, pick_values - cur_feature.unsqueeze(1),
+                                           logits.size(0), self.curve_num, self.k)
+            logits = torch.mul(logits, d.view_as(logits))
+
+        logits = gumbel_softmax(logits, -1).view(-1, 1, self.k) # bs*n, 1, k
+        cur_feature = torch.bmm(logits, pick_values).squeeze(1) # bs*n, c
+        cur = torch.argmax(logits, dim=-1) # bs*n, 1
+        return cur_feature, torch.gather(pick_idx, 1, cur).squeeze(1)
+
     def forward(self, xyz, x, adj, cur):
         bn, c, tot_points = x.size()
 
+        # point features
+        x = x.transpose(1,2).contiguous() # bs, n, c
+
+        flatten_x = x.view(bn * tot_points, -1)
+        batch_offset = torch.arange(0, bn, device=x.device) * tot_points
+
+        # indices of neighbors for the starting points
+        tmp_adj = (adj + batch_offset.view(-1,1,1)).view(adj.size(0)*adj.size(1),-1) #bs*n, k
+
+        # batch flattened indices for the starting points
+        flatten_cur = (cur + batch_offset.view(-1,1,1)).view(-1)
+
+        # agent_mlp is a 1x1 conv over [neighbor, curve descriptor]: the neighbor half is projected once for all
+        # points, so a step gathers one logit per neighbor instead of concatenating a bs, 2c, n, k tensor.
+        flatten_logit = torch.mv(flatten_x, self.agent_mlp[0].weight.view(2, c)[0]) # bs*n_points
+
+        # curve progress is written into a preallocated buffer
+        curves = x.new_empty(bn, c, self.curve_num, self.curve_length)
+
+        # starting point features
+        pre_feature = flatten_x[flatten_cur] # bs*n, c
+        cur_feature = None
+
+        # one step at a time
+        for step in range(self.curve_length):
+            if step != 0:
+                # dynamic momentum
+                cat_feature = torch.cat((cur_feature.view(bn, self.curve_num, c),
+                                         pre_feature.view(bn, self.curve_num, c)), dim=-1).transpose(1, 2) # bs, 2c, n
+                att_feature = F.softmax(self.momentum_mlp(cat_feature),dim=1).view(-1, 2) # bs*n, 2
+
+                # update curve descriptor
+                pre_feature = cur_feature * att_feature[:, :1] + pre_feature * att_feature[:, 1:] # bs*n, c
+
+            cur_feature, flatten_cur = self.walk_step(flatten_x, flatten_logit, tmp_adj, flatten_cur,
+                                                      pre_feature, cur_feature)
+
+            # collect curve progress
+            curves[:, :, :, step] = cur_feature.view(bn, self.curve_num, c).transpose(1, 2)
+
+        return curves # bs, c, n, l
+
+    def _forward_reference(self, xyz, x, adj, cur):
+        """
+        The original step-by-step walk (dense concatenation + agent_mlp per step), kept to check and benchmark forward.
+        """
+        bn, c, tot_points = x.size()
+
         # raw point coordinates
         xyz = xyz.transpose(1,2).contiguous # bs, n, 3
 
@@ -85,7 +160,7 @@ class Walk(nn.Module):
         x = x.transpose(1,2).contiguous() # bs, n, c
 
         flatten_x = x.view(bn * tot_points, -1)
-        batch_offset = torch.arange(0, bn, device=torch.device('cuda')).detach() * tot_points
+        batch_offset = torch.arange(0, bn, device=x.device).detach() * tot_points
 
         # indices of neighbors for the starting points
         tmp_adj = (adj + batch_offset.view(-1,1,1)).view(adj.size(0)*adj.size(1),-1) #bs, n, k
@@ -135,7 +210,7 @@ class Walk(nn.Module):
             if step !=0:
                 # cross over supression
                 d = self.crossover_suppression(cur_feature_cos - pre_feature_cos,
-                                               pick_values_cos - cur_feature_cos.unsqueeze(-1), 
+                                               (pick_values_cos - cur_feature_cos.unsqueeze(-1)).transpose(1, 2),
                                                bn, self.curve_num, self.k)
                 d = d.view(bn, self.curve_num, self.k).unsqueeze(1) # bs, 1, n, k
                 pre_feature_expand = torch.mul(pre_feature_expand, d)
@@ -154,3 +229,58 @@ class Walk(nn.Module):
             curves.append(cur_feature)
 
         return torch.cat(curves,dim=-1)
+
+
+if __name__ == '__main__':
+    # Step cost of the walks of the curvenet_seg / curvenet_seg2 configs, against the original loop
+    # (run from partseg_curvenet): python -m models.walk --batch_size 8
+    import argparse
+    import time
+    from .curvenet_seg import CurveNet
+    from .curvenet_seg2 import CurveNet2
+    from .curvenet_util import CIC, knn
+
+    parser = argparse.ArgumentParser('walk benchmark')
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--device', default=None, help='cuda or cpu (default: cuda if available)')
+    args = parser.parse_args()
+    device = args.device if args.device is not None else ('cuda' if torch.cuda.is_available() else 'cpu')
+
+    def run(fn, x, train):
+        def once():
+            out = fn(x)
+            if train:
+                out.sum().backward()
+            return out
+        once()  # warmup
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            out = once()
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        return out, (time.perf_counter() - start) / args.repeat
+
+    print(f"==> device: {device}, batch_size: {args.batch_size}")
+    print("model      layer  points c   k   curves x len | mode  | loop ms/step  fused ms/step  speedup | same curves")
+    for model in [CurveNet(), CurveNet2()]:
+        for name, module in model.named_modules():
+            if not isinstance(module, CIC) or not module.use_curve:
+                continue
+            walk = module.curvegrouping.walk.to(device)
+            c = walk.agent_mlp[0].weight.shape[1] // 2
+            xyz = torch.rand(args.batch_size, 3, module.npoint, device=device)
+            adj = knn(xyz, walk.k)[:, :, 1:]
+            cur = torch.randint(0, module.npoint, (args.batch_size, walk.curve_num, 1), device=device)
+            for train in [False, True]:
+                walk.train(train)
+                x = torch.randn(args.batch_size, c, module.npoint, device=device, requires_grad=train)
+                with torch.set_grad_enabled(train):
+                    ref, ref_t = run(lambda a: walk._forward_reference(xyz, a, adj, cur), x, train)
+                    out, out_t = run(lambda a: walk(xyz, a, adj, cur), x, train)
+                print(f"{type(model).__name__:<10} {name:<6} {module.npoint:<6} {c:<3} {walk.k:<3} "
+                      f"{walk.curve_num:<6} x {walk.curve_length:<3} | {'train' if train else 'eval':<5} | "
+                      f"{ref_t / walk.curve_length * 1e3:12.3f}  {out_t / walk.curve_length * 1e3:13.3f}  "
+                      f"{ref_t / out_t:6.2f}x | {torch.allclose(ref, out)}")
@@ -15,7 +15,8 @@ import torch.nn as nn
 import model as models
 import numpy as np
 from torch.utils.data import DataLoader
-from util.util import to_categorical, compute_overall_iou, IOStream
+from util.metrics import ConfusionMatrix
+from util.util import to_categorical, compute_overall_iou, compute_shape_ious, IOStream
 from tqdm import tqdm
 from collections import defaultdict
 from torch.autograd import Variable
@@ -93,7 +94,8 @@ def train(args, io):
     train_data = PartNormalDataset(npoints=2048, split='trainval', normalize=args.normalize)
     print("The number of training data is:%d", len(train_data))
 
-    test_data = PartNormalDataset(npoints=2048, split='test', normalize=args.normalize)
+    test_data = PartNormalDataset(npoints=2048, split='test', normalize=args.normalize,
+                                  seed=None if args.test_seed < 0 else args.test_seed)
     print("The number of test data is:%d", len(test_data))
 
     train_loader = DataLoader(train_data, batch_size=args.batch_size, shuffle=True, num_workers=args.workers,
@@ -254,10 +256,11 @@ def test_epoch(test_loader, model, epoch, num_part, num_classes, io):
     time_cost = datetime.datetime.now()
     test_loss = 0.0
     count = 0.0
-    accuracy = []
+    metric = ConfusionMatrix(num_part)
     shape_ious = 0.0
-    final_total_per_cat_iou = np.zeros(16).astype(np.float32)
-    final_total_per_cat_seen = np.zeros(16).astype(np.int32)
+    # per category iou sums and counts stay on the device and are read once after the loop
+    total_per_cat_iou = torch.zeros(16, dtype=torch.float64).cuda()
+    total_per_cat_seen = torch.zeros(16, dtype=torch.float64).cuda()
     metrics = defaultdict(lambda: list())
     model.eval()
 
@@ -273,16 +276,10 @@ def test_epoch(test_loader, model, epoch, num_part, num_classes, io):
         seg_pred = model(points, norm_plt, to_categorical(label, num_classes))  # b,n,50
 
         # instance iou without considering the class average at each batch_size:
-        batch_shapeious = compute_overall_iou(seg_pred, target, num_part)  # [b]
+        batch_shapeious = compute_shape_ious(seg_pred, target, num_part)  # [b]
         # per category iou at each batch_size:
-
-        for shape_idx in range(seg_pred.size(0)):  # sample_idx
-            cur_gt_label = label[shape_idx]  # label[sample_idx], denotes current sample belongs to which cat
-            final_total_per_cat_iou[cur_gt_label] += batch_shapeious[shape_idx]  # add the iou belongs to this cat
-            final_total_per_cat_seen[cur_gt_label] += 1  # count the number of this cat is chosen
-
-        # total iou of current batch in each process:
-        batch_ious = seg_pred.new_tensor([np.sum(batch_shapeious)], dtype=torch.float64)  # same device with seg_pred!!!
+        total_per_cat_iou.index_add_(0, label, batch_shapeious)
+        total_per_cat_seen.index_add_(0, label, torch.ones_like(batch_shapeious))
 
         # prepare seg_pred and target for later calculating loss and acc:
         seg_pred = seg_pred.contiguous().view(-1, num_part)
@@ -290,21 +287,23 @@ def test_epoch(test_loader, model, epoch, num_part, num_classes, io):
         # Loss
         loss = F.nll_loss(seg_pred.contiguous(), target.contiguous())
 
-        # accuracy:
-        pred_choice = seg_pred.data.max(1)[1]  # b*n
-        correct = pred_choice.eq(target.data).sum()  # torch.int64: total number of correct-predict pts
+        # accuracy: the confusion matrix stays on the device and is read once after the loop
+        metric.update(seg_pred.data, target.data)
 
         loss = torch.mean(loss)
-        shape_ious += batch_ious.item()  # count the sum of ious in each iteration
+        shape_ious += batch_shapeious.sum()  # count the sum of ious in each iteration
         count += batch_size  # count the total number of samples in each iteration
-        test_loss += loss.item() * batch_size
-        accuracy.append(correct.item() / (batch_size * num_point))  # append the accuracy of each iteration
+        test_loss += loss.detach() * batch_size
 
+    final_total_per_cat_iou = total_per_cat_iou.cpu().numpy().astype(np.float32)
+    final_total_per_cat_seen = total_per_cat_seen.cpu().numpy().astype(np.int32)
     for cat_idx in range(16):
         if final_total_per_cat_seen[cat_idx] > 0:  # indicating this cat is included during previous iou appending
             final_total_per_cat_iou[cat_idx] = final_total_per_cat_iou[cat_idx] / final_total_per_cat_seen[cat_idx]  # avg class iou across all samples
 
-    metrics['accuracy'] = np.mean(accuracy)
+    test_loss = float(test_loss)
+    shape_ious = float(shape_ious)
+    metrics['accuracy'] = metric.allAcc()
     metrics['shape_avg_iou'] = shape_ious * 1.0 / count
 
     time_cost = int((datetime.datetime.now() - time_cost).total_seconds())
@@ -318,7 +317,8 @@ def test_epoch(test_loader, model, epoch, num_part, num_classes, io):
 
 def test(args, io):
     # Dataloader
-    test_data = PartNormalDataset(npoints=2048, split='test', normalize=False)
+    test_data = PartNormalDataset(npoints=2048, split='test', normalize=False,
+                                  seed=None if args.test_seed < 0 else args.test_seed)
     print("The number of test data is:%d", len(test_data))
 
     test_loader = DataLoader(test_data, batch_size=args.test_batch_size, shuffle=False, num_workers=8,
@@ -422,6 +422,8 @@ if __name__ == "__main__":
                         help='enables CUDA training')
     parser.add_argument('--manual_seed', type=int, metavar='S',
                         help='random seed (default: 1)')
+    parser.add_argument('--test_seed', type=int, default=0,
+                        help='seed of the fixed test resampling table, -1 to resample on every pass')
     parser.add_argument('--eval', type=bool,  default=False,
                         help='evaluate the model')
 
@@ -0,0 +1,67 @@
+import torch
+
+
+class ConfusionMatrix(object):
+    """
+    Streaming [num_classes, num_classes] confusion matrix (rows: target, cols: prediction) kept on the device of
+    the predictions. Each update is one index_add_, and ignore_index points go to a dropped extra bin instead of
+    being masked out, so nothing is synchronized or copied until a metric is read.
+    Same definitions as intersectionAndUnion: intersection = diag, union = row + col - diag, target = row.
+    """
+    def __init__(self, num_classes, ignore_index=None):
+        self.num_classes = num_classes
+        self.ignore_index = ignore_index
+        self.matrix = None
+
+    def reset(self):
+        self.matrix = None
+
+    def update(self, output, target, class_dim=1):
+        """
+        output: logits with the classes on class_dim (e.g. [B, C, N] or [B * N, C]),
+                or predicted labels with the shape of target
+        target: labels, e.g. [B, N]
+        """
+        if output.dim() == target.dim() + 1:
+            output = output.max(dim=class_dim)[1]
+        pred, target = output.reshape(-1), target.reshape(-1)
+        num_bins = self.num_classes * self.num_classes
+        if self.matrix is None:
+            self.matrix = torch.zeros(num_bins + 1, dtype=torch.long, device=pred.device)
+        index = target * self.num_classes + pred
+        if self.ignore_index is not None:
+            index = torch.where(target == self.ignore_index, torch.full_like(index, num_bins), index)
+        self.matrix.index_add_(0, index, torch.ones_like(index))
+
+    def confusion(self):
+        return self.matrix[:-1].view(self.num_classes, self.num_classes)
+
+    def intersection_union_target(self):
+        """
+        Return: intersection, union, target, [num_classes] each (long tensors)
+        """
+        matrix = self.confusion()
+        intersection = matrix.diagonal()
+        target = matrix.sum(dim=1)
+        union = target + matrix.sum(dim=0) - intersection
+        return intersection, union, target
+
+    def iou(self):
+        """per-class IoU [num_classes], numpy"""
+        intersection, union, _ = self.intersection_union_target()
+        return (intersection.double() / (union.double() + 1e-10)).cpu().numpy()
+
+    def class_accuracy(self):
+        """per-class accuracy (recall) [num_classes], numpy"""
+        intersection, _, target = self.intersection_union_target()
+        return (intersection.double() / (target.double() + 1e-10)).cpu().numpy()
+
+    def mIoU(self):
+        return float(self.iou().mean())
+
+    def mAcc(self):
+        return float(self.class_accuracy().mean())
+
+    def allAcc(self):
+        intersection, _, target = self.intersection_union_target()
+        return (intersection.sum().double() / (target.sum().double() + 1e-10)).item()
@@ -10,7 +10,8 @@ import torch.nn as nn
 import model as models
 import numpy as np
 from torch.utils.data import DataLoader
-from util.util import to_categorical, compute_overall_iou, IOStream
+from util.metrics import ConfusionMatrix
+from util.util import to_categorical, compute_shape_ious, multi_scale_vote, IOStream
 from tqdm import tqdm
 from collections import defaultdict
 from torch.autograd import Variable
@@ -19,19 +20,6 @@ import random
 
 classes_str = ['aero','bag','cap','car','chair','ear','guitar','knife','lamp','lapt','moto','mug','Pistol','rock','stake','table']
 
-class PointcloudScale(object):
-    def __init__(self, scale_low=2. / 3., scale_high=3. / 2.):
-        self.scale_low = scale_low
-        self.scale_high = scale_high
-
-    def __call__(self, pc):
-        bsize = pc.size()[0]
-        for i in range(bsize):
-            xyz = np.random.uniform(low=self.scale_low, high=self.scale_high, size=[3])
-            pc[i, :, 0:3] = torch.mul(pc[i, :, 0:3], torch.from_numpy(xyz).float().cuda())
-        return pc
-
-
 def _init_():
     if not os.path.exists('checkpoints'):
         os.makedirs('checkpoints')
@@ -67,7 +55,8 @@ def voting(args, io):
 
 
     # =========== Dataloader =================
-    test_data = PartNormalDataset(npoints=2048, split='test', normalize=False)
+    test_data = PartNormalDataset(npoints=2048, split='test', normalize=False,
+                                  seed=None if args.test_seed < 0 else args.test_seed)
     print("The number of test data is:%d", len(test_data))
     test_loader = DataLoader(test_data, batch_size=args.test_batch_size, shuffle=False, num_workers=6,
                              drop_last=False)
@@ -107,13 +96,13 @@ def voting(args, io):
 
 
 def test_epoch(test_loader, model, epoch, num_part, num_classes, io):
-    pointscale = PointcloudScale(scale_low=0.87, scale_high=1.15)
     test_loss = 0.0
     count = 0.0
-    accuracy = []
+    metric = ConfusionMatrix(num_part)
     shape_ious = 0.0
-    final_total_per_cat_iou = np.zeros(16).astype(np.float32)
-    final_total_per_cat_seen = np.zeros(16).astype(np.int32)
+    # per category iou sums and counts stay on the device and are read once after the loop
+    total_per_cat_iou = torch.zeros(16, dtype=torch.float64).cuda()
+    total_per_cat_seen = torch.zeros(16, dtype=torch.float64).cuda()
     metrics = defaultdict(lambda: list())
     model.eval()
 
@@ -123,27 +112,18 @@ def test_epoch(test_loader, model, epoch, num_part, num_classes, io):
         points, label, target, norm_plt = Variable(points.float()), Variable(label.long()), Variable(target.long()), \
                                           Variable(norm_plt.float())
         norm_plt = norm_plt.transpose(2, 1)
-        seg_pred = 0.
         points, label, target, norm_plt = points.cuda(non_blocking=True), label.squeeze(1).cuda(non_blocking=True), \
-                                              target.cuda(non_blocking=True), norm_plt.cuda(non_blocking=True)
-        for v in range(args.NUM_VOTE):
-            scaled_point = pointscale(points)
-            scaled_point = scaled_point.transpose(2, 1)
-            seg_pred_v = model(scaled_point, norm_plt, to_categorical(label, num_classes))  # b,n,50
-            seg_pred += seg_pred_v
-        seg_pred /= args.NUM_VOTE
+                                          target.cuda(non_blocking=True), norm_plt.cuda(non_blocking=True)
+        # all votes of the batch, stacked into args.votes_per_forward-sized forwards
+        seg_pred = multi_scale_vote(model, points, norm_plt, to_categorical(label, num_classes),
+                                    args.NUM_VOTE, votes_per_forward=args.votes_per_forward,
+                                    compound=args.compound_scale)  # b,n,50
 
         # instance iou without considering the class average at each batch_size:
-        batch_shapeious = compute_overall_iou(seg_pred, target, num_part)  # [b]
+        batch_shapeious = compute_shape_ious(seg_pred, target, num_part)  # [b]
         # per category iou at each batch_size:
-
-        for shape_idx in range(seg_pred.size(0)):  # sample_idx
-            cur_gt_label = label[shape_idx]  # label[sample_idx], denotes current sample belongs to which cat
-            final_total_per_cat_iou[cur_gt_label] += batch_shapeious[shape_idx]  # add the iou belongs to this cat
-            final_total_per_cat_seen[cur_gt_label] += 1  # count the number of this cat is chosen
-
-        # total iou of current batch in each process:
-        batch_ious = seg_pred.new_tensor([np.sum(batch_shapeious)], dtype=torch.float64)  # same device with seg_pred!!!
+        total_per_cat_iou.index_add_(0, label, batch_shapeious)
+        total_per_cat_seen.index_add_(0, label, torch.ones_like(batch_shapeious))
 
         # prepare seg_pred and target for later calculating loss and acc:
         seg_pred = seg_pred.contiguous().view(-1, num_part)
@@ -151,21 +131,23 @@ def test_epoch(test_loader, model, epoch, num_part, num_classes, io):
         # Loss
         loss = F.nll_loss(seg_pred.contiguous(), target.contiguous())
 
-        # accuracy:
-        pred_choice = seg_pred.data.max(1)[1]  # b*n
-        correct = pred_choice.eq(target.data).sum()  # torch.int64: total number of correct-predict pts
+        # accuracy: the confusion matrix stays on the device and is read once after the loop
+        metric.update(seg_pred.data, target.data)
 
         loss = torch.mean(loss)
-        shape_ious += batch_ious.item()  # count the sum of ious in each iteration
+        shape_ious += batch_shapeious.sum()  # count the sum of ious in each iteration
         count += batch_size  # count the total number of samples in each iteration
-        test_loss += loss.item() * batch_size
-        accuracy.append(correct.item() / (batch_size * num_point))  # append the accuracy of each iteration
+        test_loss += loss.detach() * batch_size
 
+    final_total_per_cat_iou = total_per_cat_iou.cpu().numpy().astype(np.float32)
+    final_total_per_cat_seen = total_per_cat_seen.cpu().numpy().astype(np.int32)
     for cat_idx in range(16):
         if final_total_per_cat_seen[cat_idx] > 0:  # indicating this cat is included during previous iou appending
             final_total_per_cat_iou[cat_idx] = final_total_per_cat_iou[cat_idx] / final_total_per_cat_seen[cat_idx]  # avg class iou across all samples
 
-    metrics['accuracy'] = np.mean(accuracy)
+    test_loss = float(test_loss)
+    shape_ious = float(shape_ious)
+    metrics['accuracy'] = metric.allAcc()
     metrics['shape_avg_iou'] = shape_ious * 1.0 / count
 
     outstr = 'Test %d, loss: %f, test acc: %f  test ins_iou: %f' % (epoch + 1, test_loss * 1.0 / count,
@@ -201,6 +183,8 @@ if __name__ == "__main__":
                         help='enables CUDA training')
     parser.add_argument('--manual_seed', type=int, metavar='S',
                         help='random seed (default: 1)')
+    parser.add_argument('--test_seed', type=int, default=0,
+                        help='seed of the fixed test resampling table, -1 to resample on every pass')
     parser.add_argument('--eval', type=bool,  default=False,
                         help='evaluate the model')
     parser.add_argument('--num_points', type=int, default=1024,
@@ -212,6 +196,10 @@ if __name__ == "__main__":
 
     # voting
     parser.add_argument('--NUM_VOTE', type=int, default=10)
+    parser.add_argument('--votes_per_forward', type=int, default=2,
+                        help='votes stacked into one forward (activation memory grows with it), 0 for all NUM_VOTE')
+    parser.add_argument('--compound_scale', action='store_true',
+                        help='compound the scales over votes, as the earlier per-vote loop did')
     parser.add_argument('--epochs', type=int, default=200)
 
     args = parser.parse_args()
@@ -0,0 +1,96 @@
+"""
+Neighborhood (fps + knn index) cache for LocalGrouper.
+During voting, the same test batches are fed again and again (re-scaled), so the sampling/grouping indices can be
+reused instead of re-running furthest_point_sample and the [B, S, N] knn.
+Entries are keyed by the source of the input, set by the caller around every forward (e.g. (batch index, vote
+chunk)), plus the input shape and device; the coordinates themselves are never compared, so a lookup does not
+synchronize with the device. The key ignores whatever transform was applied to the source (e.g. the voting
+scales): the indices are exact for isotropic scaling (fps order and knn ranking are preserved) and an
+approximation for anisotropic scaling.
+Usage:
+    enable_neighbor_cache(net, max_entries=len(batches))   # net may be wrapped by DataParallel
+    with neighbor_cache_key(net, (batch_idx, chunk_idx)):
+        net(data)
+    ...
+    disable_neighbor_cache(net)
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class NeighborCache(object):
+    def __init__(self, max_entries=64):
+        """
+        :param max_entries: number of cached forwards (LRU). Should be at least the number of distinct keys
+                            cycled through, otherwise the LRU never hits.
+        """
+        assert max_entries is not None and max_entries > 0, "NeighborCache needs a bounded max_entries."
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.current_key = None
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, xyz):
+        """
+        :param xyz: [B, N, 3]
+        :return: (key, fps_idx [B, S], knn_idx [B, S, k]) indices are None if not cached; key is None (and the
+                 forward is not cached) when no key was set with neighbor_cache_key.
+        """
+        if self.current_key is None:
+            return None, None, None
+        key = (self.current_key, tuple(xyz.shape), xyz.device)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return key, None, None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return key, entry[0].long(), entry[1].long()
+
+    def store(self, key, fps_idx, knn_idx):
+        if key is None:
+            return
+        # int32 indices halve the footprint of the cache.
+        self.entries[key] = (fps_idx.int(), knn_idx.int())
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def enable_neighbor_cache(net, max_entries=64):
+    """
+    Attach a NeighborCache to every LocalGrouper of net. The cache is only used in eval mode.
+    Return the list of caches (one per grouper), e.g. to report hits/misses.
+    """
+    caches = []
+    for module in net.modules():
+        if hasattr(module, "neighbor_cache"):
+            module.neighbor_cache = NeighborCache(max_entries=max_entries)
+            caches.append(module.neighbor_cache)
+    return caches
+
+
+@contextmanager
+def neighbor_cache_key(net, key):
+    """
+    Tag the forwards run inside the block with key (any hashable identifying the source clouds).
+    """
+    caches = [module.neighbor_cache for module in net.modules() if getattr(module, "neighbor_cache", None) is not None]
+    for cache in caches:
+        cache.current_key = key
+    try:
+        yield
+    finally:
+        for cache in caches:
+            cache.current_key = None
+
+
+def disable_neighbor_cache(net):
+    for module in net.modules():
+        if hasattr(module, "neighbor_cache"):
+            module.neighbor_cache = None
@@ -4,6 +4,7 @@ import numpy as np
 from torch.utils.data import Dataset
 import os
 import json
+import shutil
 os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
 
 
@@ -65,8 +66,122 @@ class ModelNet40(Dataset):
 
 
 # =========== ShapeNet Part =================
+def build_shape_store(root, store_root=None):
+    """
+    One-time conversion of the ShapeNetPart <synset>/<token>.txt files (x y z nx ny nz label, one point per line)
+    into a packed store next to root:
+        points.npy (float32, T*3), normals.npy (float32, T*3), labels.npy (uint8, T), offsets.npy (int64, S+1),
+        shapes.txt (paths relative to root)
+    with shape i in rows offsets[i]:offsets[i + 1]. All splits share one store.
+    Delete the store to rebuild it after the .txt files change.
+    Return: store_root
+    """
+    store_root = root.rstrip('/') + '_store' if store_root is None else store_root
+    if os.path.exists(os.path.join(store_root, 'shapes.txt')):
+        return store_root
+    shapes = []
+    for synset in sorted(os.listdir(root)):
+        if synset == 'train_test_split' or not os.path.isdir(os.path.join(root, synset)):
+            continue
+        shapes += [os.path.join(synset, fn) for fn in sorted(os.listdir(os.path.join(root, synset)))
+                   if fn.endswith('.txt')]
+    print('Packing %d shapes of %s into %s..' % (len(shapes), root, store_root))
+    sizes = []
+    for shape in shapes:
+        with open(os.path.join(root, shape), 'r') as f:
+            sizes.append(sum(1 for line in f if line.strip()))
+    offsets = np.zeros(len(shapes) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(sizes)
+    # write to a per-process temporary directory first, so concurrent jobs never see a half-written store.
+    tmp_root = '%s.%d.tmp' % (store_root, os.getpid())
+    os.makedirs(tmp_root, exist_ok=True)
+    num_total = int(offsets[-1])
+    path = lambda name: os.path.join(tmp_root, name)
+    points = np.lib.format.open_memmap(path('points.npy'), mode='w+', dtype=np.float32, shape=(num_total, 3))
+    normals = np.lib.format.open_memmap(path('normals.npy'), mode='w+', dtype=np.float32, shape=(num_total, 3))
+    labels = np.lib.format.open_memmap(path('labels.npy'), mode='w+', dtype=np.uint8, shape=(num_total,))
+    for i, shape in enumerate(shapes):
+        shape_data = np.loadtxt(os.path.join(root, shape)).astype(np.float32).reshape(-1, 7)
+        s, e = offsets[i], offsets[i + 1]
+        points[s:e], normals[s:e], labels[s:e] = shape_data[:, 0:3], shape_data[:, 3:6], shape_data[:, -1]
+    points.flush(), normals.flush(), labels.flush()
+    del points, normals, labels
+    np.save(path('offsets.npy'), offsets)
+    with open(path('shapes.txt'), 'w') as f:
+        f.write('\n'.join(shapes) + '\n')
+    try:
+        os.replace(tmp_root, store_root)
+    except OSError:  # another process finished first
+        shutil.rmtree(tmp_root)
+    return store_root
+
+
+# bump when the way choice tables are generated changes, so stale tables are not reused.
+CHOICE_TABLE_VERSION = 1
+
+
+def make_choice_table(sizes, npoints, seed):
+    """
+    Fixed resampling indices: row i holds npoints indices into a shape of sizes[i] points, drawn with replacement
+    from np.random.RandomState(seed) in row order, independently of the global np.random state.
+    Return: [len(sizes), npoints] int32
+    """
+    rng = np.random.RandomState(seed)
+    choice = np.empty((len(sizes), npoints), dtype=np.int32)
+    for i, size in enumerate(sizes):
+        choice[i] = rng.choice(size, npoints, replace=True)
+    return choice
+
+
+def load_choice_table(store_root, split, store_index, sizes, npoints, seed):
+    """
+    make_choice_table of one split, cached in store_root as choice_v<version>_<split>_<npoints>_seed<seed>.npy.
+    store_index: store row of every shape of the split, saved with the table and checked on load.
+    """
+    path = os.path.join(store_root, 'choice_v%d_%s_%d_seed%d.npy' % (CHOICE_TABLE_VERSION, split, npoints, seed))
+    store_index = np.asarray(store_index, dtype=np.int32)
+    if os.path.exists(path):
+        table = np.load(path)
+        if np.array_equal(table[:, 0], store_index):
+            return table[:, 1:].astype(np.int32)
+        print('Choice table %s does not match the split, rebuilding..' % path)
+    choice = make_choice_table(sizes, npoints, seed)
+    tmp_path = '%s.%d.tmp.npy' % (path[:-4], os.getpid())
+    np.save(tmp_path, np.concatenate([store_index[:, None], choice], axis=1))
+    os.replace(tmp_path, path)
+    return choice
+
+
+class ShapeStore(object):
+    """
+    Read-only view of a build_shape_store directory. Every shape is a slice of the memory-mapped arrays, so
+    opening the store copies nothing and the pages are shared by all DataLoader workers through the page cache.
+    """
+    def __init__(self, store_root):
+        self.store_root = store_root
+        self.shapes = [line.rstrip('\n') for line in open(os.path.join(store_root, 'shapes.txt'))]
+        self.shape_index = {shape: i for i, shape in enumerate(self.shapes)}
+        self.offsets = np.load(os.path.join(store_root, 'offsets.npy'))
+        self.points = np.load(os.path.join(store_root, 'points.npy'), mmap_mode='r')
+        self.normals = np.load(os.path.join(store_root, 'normals.npy'), mmap_mode='r')
+        self.labels = np.load(os.path.join(store_root, 'labels.npy'), mmap_mode='r')
+
+    def __getitem__(self, i):
+        """
+        i: shape index, see shape_index. Return: points [N, 3] float32, normals [N, 3] float32, labels [N] uint8
+        """
+        s, e = self.offsets[i], self.offsets[i + 1]
+        return self.points[s:e], self.normals[s:e], self.labels[s:e]
+
+
 class PartNormalDataset(Dataset):
-    def __init__(self, npoints=2500, split='train', normalize=False):
+    def __init__(self, npoints=2500, split='train', normalize=False, use_store=True, seed=None):
+        """
+        use_store: read the shapes from the packed build_shape_store files (built on first use) instead of
+        parsing every .txt with np.loadtxt and caching it per worker.
+        seed: resample every shape with a fixed choice table (saved next to the store) instead of calling
+        np.random.choice on each access, so test/vote results do not depend on the global seed or num_workers.
+        """
         self.npoints = npoints
         self.root = './data/shapenetcore_partanno_segmentation_benchmark_v0_normal'
         self.catfile = os.path.join(self.root, 'synsetoffset2category.txt')
@@ -120,11 +235,24 @@ class PartNormalDataset(Dataset):
                             'Table': [47, 48, 49], 'Airplane': [0, 1, 2, 3], 'Pistol': [38, 39, 40],
                             'Chair': [12, 13, 14, 15], 'Knife': [22, 23]}
 
+        self.use_store = use_store
+        if self.use_store:
+            self.store = ShapeStore(build_shape_store(self.root))
+            self.store_index = [self.store.shape_index[os.path.relpath(fn, self.root)] for _, fn in self.datapath]
+        self.choice = None
+        if seed is not None:
+            assert self.use_store, "a fixed choice table is stored with the packed data, set use_store=True"
+            sizes = self.store.offsets[1:] - self.store.offsets[:-1]
+            self.choice = load_choice_table(self.store.store_root, split, self.store_index,
+                                            sizes[self.store_index], npoints, seed)
         self.cache = {}  # from index to (point_set, cls, seg) tuple
         self.cache_size = 20000
 
     def __getitem__(self, index):
-        if index in self.cache:
+        if self.use_store:
+            cls = np.array([self.classes[self.datapath[index][0]]]).astype(np.int32)
+            point_set, normal, seg = self.store[self.store_index[index]]  # zero-copy slices of the memmaps
+        elif index in self.cache:
             point_set, normal, seg, cls = self.cache[index]
         else:
             fn = self.datapath[index]
@@ -141,13 +269,16 @@ class PartNormalDataset(Dataset):
         if self.normalize:
             point_set = pc_normalize(point_set)
 
-        choice = np.random.choice(len(seg), self.npoints, replace=True)
+        if self.choice is not None:
+            choice = self.choice[index]
+        else:
+            choice = np.random.choice(len(seg), self.npoints, replace=True)
 
         # resample
         # note that the number of points in some points clouds is less than 2048, thus use random.choice
         # remember to use the same seed during train and test for a getting stable result
         point_set = point_set[choice, :]
-        seg = seg[choice]
+        seg = seg[choice].astype(np.int32)
         normal = normal[choice, :]
 
         return point_set, cls, seg, normal
@@ -45,25 +45,72 @@ def to_categorical(y, num_classes):
     return new_y
 
 
+def compute_shape_ious(pred, target, num_classes):
+    """
+    Batched version of compute_overall_iou that stays on the device of pred.
+    Input:
+        pred: [B, N, num_classes] logits, or [B, N] predicted part labels
+        target: [B, N] part labels
+    Return:
+        shape_ious: [B] float64 tensor, mean iou over the parts present in each target shape
+    """
+    if pred.dim() == target.dim() + 1:
+        pred = pred.max(dim=2)[1]
+    batch_size = pred.size(0)
+    pred = pred.reshape(batch_size, -1).long()
+    target = target.reshape(batch_size, -1).long()
+    # one bin per (shape, part); the last bin collects the wrong predictions for the intersection.
+    offset = torch.arange(batch_size, device=pred.device).view(-1, 1) * num_classes
+    dropped = batch_size * num_classes
+    ones = torch.ones(pred.numel(), dtype=torch.float64, device=pred.device)
+    pred_count = torch.zeros(dropped, dtype=torch.float64, device=pred.device).index_add_(
+        0, (pred + offset).view(-1), ones)
+    target_count = torch.zeros(dropped, dtype=torch.float64, device=pred.device).index_add_(
+        0, (target + offset).view(-1), ones)
+    index = torch.where(pred == target, target + offset, torch.full_like(target, dropped))
+    intersection = torch.zeros(dropped + 1, dtype=torch.float64, device=pred.device).index_add_(
+        0, index.view(-1), ones)[:dropped]
+    union = pred_count + target_count - intersection
+    # parts absent from the target shape are skipped, as in compute_overall_iou.
+    present = (target_count > 0).view(batch_size, num_classes)
+    part_ious = (intersection / union.clamp(min=1)).view(batch_size, num_classes)
+    return (part_ious * present).sum(dim=1) / present.sum(dim=1)
+
+
 def compute_overall_iou(pred, target, num_classes):
-    shape_ious = []
-    pred = pred.max(dim=2)[1]    # (batch_size, num_points)  the pred_class_idx of each point in each sample
-    pred_np = pred.cpu().data.numpy()
+    """
+    pred: [B, N, num_classes] logits, target: [B, N]. Return the per-shape mean part iou as a list [B].
+    """
+    return compute_shape_ious(pred, target, num_classes).tolist()   # [batch_size]
+
 
+def _compute_overall_iou_loop(pred, target, num_classes):
+    # reference per-shape, per-part loop, kept for the equivalence check below.
+    shape_ious = []
+    pred_np = pred.max(dim=2)[1].cpu().data.numpy()
     target_np = target.cpu().data.numpy()
-    for shape_idx in range(pred.size(0)):   # sample_idx
+    for shape_idx in range(pred_np.shape[0]):
         part_ious = []
-        for part in range(num_classes):   # class_idx! no matter which category, only consider all part_classes of all categories, check all 50 classes
-            # for target, each point has a class no matter which category owns this point! also 50 classes!!!
-            # only return 1 when both belongs to this class, which means correct:
+        for part in range(num_classes):
             I = np.sum(np.logical_and(pred_np[shape_idx] == part, target_np[shape_idx] == part))
-            # always return 1 when either is belongs to this class:
             U = np.sum(np.logical_or(pred_np[shape_idx] == part, target_np[shape_idx] == part))
-
             F = np.sum(target_np[shape_idx] == part)
-
             if F != 0:
-                iou = I / float(U)    #  iou across all points for this class
-                part_ious.append(iou)   #  append the iou of this class
-        shape_ious.append(np.mean(part_ious))   # each time append an average iou across all classes of this sample (sample_level!)
-    return shape_ious   # [batch_size]
+                part_ious.append(I / float(U))
+        shape_ious.append(np.mean(part_ious))
+    return shape_ious
+
+
+if __name__ == '__main__':
+    torch.manual_seed(0)
+    for batch_size, num_point, num_part in [(1, 2048, 50), (16, 2048, 50), (7, 100, 6)]:
+        target = torch.randint(0, num_part, (batch_size, num_point))
+        # few parts per shape, as in ShapeNetPart, and a mostly right prediction
+        target = target % torch.randint(1, 5, (batch_size, 1)) + torch.randint(0, num_part - 4, (batch_size, 1))
+        pred = torch.randn(batch_size, num_point, num_part)
+        pred.scatter_add_(2, target.unsqueeze(-1), 3 * torch.rand(batch_size, num_point, 1))
+        reference = _compute_overall_iou_loop(pred, target, num_part)
+        batched = compute_overall_iou(pred, target, num_part)
+        diff = np.abs(np.array(reference) - np.array(batched)).max()
+        print(f"B={batch_size} N={num_point} parts={num_part}: max abs diff {diff:.3e}")
+        assert diff < 1e-12
@@ -0,0 +1,422 @@
+"""
+Point-cloud ops shared by the model files of every project: square_distance, index_points, farthest_point_sample
+(random start, as in the model files), furthest_point_sample (start at point 0, int32, as pointnet2_ops),
+query_ball_point and knn_point, each with pluggable backends:
+- torch: reference implementations, any device. On cpu, FPS is split across the batch on FPS_THREADS threads
+  (torch ops release the GIL).
+- pointnet2_ops: the compiled CUDA kernels of pointnet2_ops (FPS, ball query).
+- pointops: the compiled CUDA kernels of lib/pointops, once installed as pointops_cuda (FPS, ball query, kNN).
+With POINT_OPS_BACKEND=auto (default) an op only runs on a compiled kernel that returns the same indices as torch,
+i.e. furthest_point_sample on pointnet2_ops (the kernel the models called before); everything else runs on torch.
+POINT_OPS_BACKEND=<name> or set_backend(name) opts in to all the kernels of a backend, falling back to torch when
+they cannot take the tensors (they need float32 cuda xyz with 3 coordinates). These kernels break ties differently
+(kNN, random-start FPS), and their ball queries exclude points at exactly the radius and give index 0 for an
+empty ball.
+The torch kNN and ball query take a block_size, to stream the reference points in blocks instead of building the
+dense [B, S, N] distance matrix; the models set it on their LocalGroupers with set_knn_block_size.
+This file is shared by all projects, install it once with `pip install -e .` from the repository root.
+Microbenchmark of the backends available here against torch:
+    python point_ops.py --batch_size 8 --k 32 --block_size 1024
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import torch
+
+try:
+    from pointnet2_ops import pointnet2_utils
+except ImportError:
+    pointnet2_utils = None
+
+try:
+    import pointops_cuda
+except ImportError:
+    pointops_cuda = None
+
+BACKENDS = ['torch', 'pointnet2_ops', 'pointops']
+BACKEND_OPS = {
+    'pointnet2_ops': {'farthest_point_sample', 'furthest_point_sample', 'query_ball_point'},
+    'pointops': {'farthest_point_sample', 'furthest_point_sample', 'query_ball_point', 'knn_point'},
+}
+# the kernels auto uses: only where they return the same indices as torch.
+AUTO_BACKENDS = {'furthest_point_sample': 'pointnet2_ops'}
+BACKEND = os.environ.get("POINT_OPS_BACKEND", "auto")
+# number of threads used across the batch by the cpu FPS, 0/1 for none.
+FPS_THREADS = int(os.environ.get("FPS_THREADS", "0"))
+
+
+def available_backends():
+    """backends usable in this environment (the compiled ones also need cuda tensors)"""
+    names = ['torch']
+    if pointnet2_utils is not None and torch.cuda.is_available():
+        names.append('pointnet2_ops')
+    if pointops_cuda is not None and torch.cuda.is_available():
+        names.append('pointops')
+    return names
+
+
+def set_backend(name):
+    """'auto' or one of BACKENDS"""
+    global BACKEND
+    assert name == 'auto' or name in BACKENDS, name
+    BACKEND = name
+
+
+def set_knn_block_size(net, block_size=1024):
+    """
+    Switch every LocalGrouper of net to the tiled kNN (block_size=None switches back to the dense knn_point).
+    """
+    for module in net.modules():
+        if hasattr(module, "knn_block_size"):
+            module.knn_block_size = block_size
+
+
+def _backend(op, xyz, new_xyz=None, nsample=0):
+    name = AUTO_BACKENDS.get(op, 'torch') if BACKEND == 'auto' else BACKEND
+    if name == 'torch' or op not in BACKEND_OPS[name]:
+        return 'torch'
+    compiled = pointnet2_utils if name == 'pointnet2_ops' else pointops_cuda
+    tensors = [xyz] if new_xyz is None else [xyz, new_xyz]
+    if compiled is None or (op == 'knn_point' and nsample > 200) or \
+            not all(t.is_cuda and t.dtype == torch.float32 and t.shape[-1] == 3 for t in tensors):
+        return 'torch'
+    return name
+
+
+def square_distance(src, dst):
+    """
+    Calculate Euclid distance between each two points.
+    src^T * dst = xn * xm + yn * ym + zn * zm；
+    sum(src^2, dim=-1) = xn*xn + yn*yn + zn*zn;
+    sum(dst^2, dim=-1) = xm*xm + ym*ym + zm*zm;
+    dist = (xn - xm)^2 + (yn - ym)^2 + (zn - zm)^2
+         = sum(src**2,dim=-1)+sum(dst**2,dim=-1)-2*src^T*dst
+    Input:
+        src: source points, [B, N, C]
+        dst: target points, [B, M, C]
+    Output:
+        dist: per-point square distance, [B, N, M]
+    """
+    B, N, _ = src.shape
+    _, M, _ = dst.shape
+    dist = -2 * torch.matmul(src, dst.permute(0, 2, 1))
+    dist += torch.sum(src ** 2, -1).view(B, N, 1)
+    dist += torch.sum(dst ** 2, -1).view(B, 1, M)
+    return dist
+
+
+def index_points(points, idx):
+    """
+    Input:
+        points: input points data, [B, N, C]
+        idx: sample index data, [B, S] or [B, S, K]
+    Return:
+        new_points:, indexed points data, [B, S, C] or [B, S, K, C]
+    """
+    device = points.device
+    B = points.shape[0]
+    view_shape = list(idx.shape)
+    view_shape[1:] = [1] * (len(view_shape) - 1)
+    repeat_shape = list(idx.shape)
+    repeat_shape[0] = 1
+    batch_indices = torch.arange(B, dtype=torch.long).to(device).view(view_shape).repeat(repeat_shape)
+    new_points = points[batch_indices, idx, :]
+    return new_points
+
+
+def _fps_loop(xyz, npoint, start):
+    B, N, _ = xyz.shape
+    xyz = xyz.detach()
+    centroids = torch.empty(B, npoint, dtype=torch.long, device=xyz.device)
+    distance = torch.full((B, N), 1e10, dtype=xyz.dtype, device=xyz.device)
+    dist = torch.empty_like(distance)
+    farthest = start
+    batch_indices = torch.arange(B, dtype=torch.long, device=xyz.device)
+    for i in range(npoint):
+        centroids[:, i] = farthest
+        centroid = xyz[batch_indices, farthest, :].view(B, 1, -1)
+        torch.sum((xyz - centroid) ** 2, -1, out=dist)
+        torch.minimum(distance, dist, out=distance)
+        farthest = torch.max(distance, -1)[1]
+    return centroids
+
+
+def _fps_torch(xyz, npoint, start):
+    num_threads = 1 if xyz.is_cuda else max(min(FPS_THREADS, xyz.shape[0]), 1)
+    if num_threads == 1:
+        return _fps_loop(xyz, npoint, start)
+    chunks = list(zip(torch.chunk(xyz, num_threads, dim=0), torch.chunk(start, num_threads, dim=0)))
+    with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+        out = list(executor.map(lambda chunk: _fps_loop(chunk[0], npoint, chunk[1]), chunks))
+    return torch.cat(out, dim=0)
+
+
+def _fps_compiled(kernel):
+    def fps(xyz, npoint, start):
+        # the kernels always start at point 0: rotate every cloud so that start comes first, and back.
+        N = xyz.shape[1]
+        order = (torch.arange(N, device=xyz.device).view(1, N) + start.view(-1, 1)) % N
+        rotated = xyz if not bool(start.any()) else index_points(xyz, order)
+        return (kernel(rotated.detach().contiguous(), npoint).long() + start.view(-1, 1)) % N
+    return fps
+
+
+def _pointops_fps(xyz, npoint):
+    b, n, _ = xyz.shape
+    idx = torch.empty(b, npoint, dtype=torch.int32, device=xyz.device)
+    temp = torch.full((b, n), 1e10, dtype=torch.float32, device=xyz.device)
+    pointops_cuda.furthestsampling_cuda(b, n, npoint, xyz, temp, idx)
+    return idx
+
+
+_FPS = {
+    'torch': _fps_torch,
+    'pointnet2_ops': _fps_compiled(lambda xyz, npoint: pointnet2_utils.furthest_point_sample(xyz, npoint)),
+    'pointops': _fps_compiled(_pointops_fps),
+}
+
+
+def farthest_point_sample(xyz, npoint, random_start=True):
+    """
+    Input:
+        xyz: pointcloud data, [B, N, 3]
+        npoint: number of samples
+        random_start: start every cloud at a random point (as the model files did), or at point 0
+    Return:
+        centroids: sampled pointcloud index, [B, npoint]
+    """
+    B, N, _ = xyz.shape
+    if random_start:
+        start = torch.randint(0, N, (B,), dtype=torch.long).to(xyz.device)
+    else:
+        start = torch.zeros(B, dtype=torch.long, device=xyz.device)
+    op = 'farthest_point_sample' if random_start else 'furthest_point_sample'
+    return _FPS[_backend(op, xyz)](xyz, npoint, start)
+
+
+def furthest_point_sample(xyz, npoint):
+    """
+    pointnet2_ops.pointnet2_utils.furthest_point_sample on any device.
+    Input:
+        xyz: pointcloud data, [B, N, 3]
+        npoint: number of samples
+    Return:
+        centroids: sampled pointcloud index, [B, npoint] (int32), starting from point 0
+    """
+    return farthest_point_sample(xyz, npoint, random_start=False).int()
+
+
+def furthest_point_sample_torch(xyz, npoint):
+    """furthest_point_sample with the pure PyTorch loop, whatever the backend"""
+    return _fps_torch(xyz, npoint, torch.zeros(xyz.shape[0], dtype=torch.long, device=xyz.device)).int()
+
+
+def _ball_query_dense(radius, nsample, xyz, new_xyz):
+    B, N, _ = xyz.shape
+    sqrdists = square_distance(new_xyz, xyz)
+    # the first nsample indices inside the ball: a partial top-k of (index, or N outside) instead of a full sort.
+    group_idx = torch.arange(N, dtype=torch.long, device=xyz.device).view(1, 1, N).expand_as(sqrdists)
+    group_idx = group_idx.masked_fill(sqrdists > radius ** 2, N)
+    group_idx = torch.topk(group_idx, min(nsample, N), dim=-1, largest=False, sorted=True)[0]
+    return group_idx
+
+
+def _ball_query_torch(radius, nsample, xyz, new_xyz, block_size=None):
+    if block_size is None:
+        return _ball_query_dense(radius, nsample, xyz, new_xyz)
+    N = xyz.shape[1]
+    best = None
+    for start in range(0, N, block_size):
+        # blocks come in index order, so a query that already holds nsample indices cannot change any more.
+        block = _ball_query_dense(radius, nsample, xyz[:, start:start + block_size], new_xyz)
+        block = torch.where(block < xyz[:, start:start + block_size].shape[1], block + start, N)
+        best = block if best is None else \
+            torch.topk(torch.cat([best, block], dim=-1), min(nsample, N), dim=-1, largest=False, sorted=True)[0]
+    return best
+
+
+def _pointops_ball_query(radius, nsample, xyz, new_xyz, block_size=None):
+    b, n, _ = xyz.shape
+    m = new_xyz.shape[1]
+    idx = torch.zeros(b, m, nsample, dtype=torch.int32, device=xyz.device)
+    pointops_cuda.ballquery_cuda(b, n, m, radius, nsample, new_xyz.contiguous(), xyz.contiguous(), idx)
+    return idx.long()
+
+
+_BALL_QUERY = {
+    'torch': _ball_query_torch,
+    'pointnet2_ops': lambda radius, nsample, xyz, new_xyz, block_size=None: pointnet2_utils.ball_query(
+        radius, nsample, xyz.contiguous(), new_xyz.contiguous()).long(),
+    'pointops': _pointops_ball_query,
+}
+
+
+def query_ball_point(radius, nsample, xyz, new_xyz, block_size=None):
+    """
+    Input:
+        radius: local region radius
+        nsample: max sample number in local region
+        xyz: all points, [B, N, 3]
+        new_xyz: query points, [B, S, 3]
+        block_size: stream xyz in blocks of block_size points (torch backend), None for the dense distances
+    Return:
+        group_idx: grouped points index, [B, S, nsample]
+    """
+    backend = _backend('query_ball_point', xyz, new_xyz)
+    group_idx = _BALL_QUERY[backend](radius, nsample, xyz, new_xyz, block_size)
+    # balls with fewer than nsample points are padded with their first point
+    group_first = group_idx[:, :, :1].expand_as(group_idx)
+    mask = group_idx == xyz.shape[1]
+    return torch.where(mask, group_first, group_idx)
+
+
+def knn_point_tiled(nsample, xyz, new_xyz, block_size=1024):
+    """
+    kNN that never materializes the dense [B, S, N] distance matrix.
+    The reference points are streamed in blocks of block_size and a running top-k is kept, so the peak extra memory
+    is [B, S, k + block_size] instead of [B, S, N]. Returns the same neighbor set as knn_point (up to ties);
+    like knn_point, the order inside the k neighbors is unspecified.
+    Input:
+        nsample: max sample number in local region
+        xyz: all points, [B, N, C]
+        new_xyz: query points, [B, S, C]
+        block_size: number of points of xyz processed at a time
+    Return:
+        group_idx: grouped points index, [B, S, nsample]
+    """
+    N = xyz.shape[1]
+    best_dist, best_idx = None, None
+    for start in range(0, N, block_size):
+        dist = square_distance(new_xyz, xyz[:, start:start + block_size])  # [B, S, block]
+        if best_dist is None:
+            best_dist, pos = torch.topk(dist, min(nsample, dist.shape[-1]), dim=-1, largest=False, sorted=False)
+            best_idx = pos + start
+            continue
+        k_prev = best_dist.shape[-1]
+        dist = torch.cat([best_dist, dist], dim=-1)  # [B, S, k + block]
+        best_dist, pos = torch.topk(dist, min(nsample, dist.shape[-1]), dim=-1, largest=False, sorted=False)
+        # positions < k_prev come from the running top-k, the others from the current block.
+        kept = torch.gather(best_idx, -1, pos.clamp(max=k_prev - 1))
+        best_idx = torch.where(pos < k_prev, kept, pos - k_prev + start)
+    return best_idx
+
+
+def _knn_torch(nsample, xyz, new_xyz, sorted=False, block_size=None):
+    if block_size is None:
+        sqrdists = square_distance(new_xyz, xyz)
+        _, group_idx = torch.topk(sqrdists, nsample, dim=-1, largest=False, sorted=sorted)
+        return group_idx
+    group_idx = knn_point_tiled(nsample, xyz, new_xyz, block_size)
+    if sorted:
+        dist = torch.sum((index_points(xyz, group_idx) - new_xyz.unsqueeze(2)) ** 2, dim=-1)
+        group_idx = torch.gather(group_idx, -1, dist.argsort(dim=-1))
+    return group_idx
+
+
+def _pointops_knn(nsample, xyz, new_xyz, sorted=False, block_size=None):
+    # the kernel keeps the neighbors nearest first anyway
+    b, n, _ = xyz.shape
+    m = new_xyz.shape[1]
+    idx = torch.zeros(b, m, nsample, dtype=torch.int32, device=xyz.device)
+    dist2 = torch.zeros(b, m, nsample, dtype=torch.float32, device=xyz.device)
+    pointops_cuda.knnquery_cuda(b, n, m, nsample, xyz.contiguous(), new_xyz.contiguous(), idx, dist2)
+    return idx.long()
+
+
+_KNN = {
+    'torch': _knn_torch,
+    'pointops': _pointops_knn,
+}
+
+
+def knn_point(nsample, xyz, new_xyz, sorted=False, block_size=None):
+    """
+    Input:
+        nsample: max sample number in local region
+        xyz: all points, [B, N, C]
+        new_xyz: query points, [B, S, C]
+        sorted: nearest first, otherwise the order inside the k neighbors is unspecified
+        block_size: stream xyz in blocks of block_size points (torch backend, see knn_point_tiled), None for the
+                    dense distances
+    Return:
+        group_idx: grouped points index, [B, S, nsample]
+    """
+    backend = _backend('knn_point', xyz, new_xyz, nsample)
+    return _KNN[backend](nsample, xyz, new_xyz, sorted, block_size)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser('point ops benchmark')
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--k', type=int, default=32)
+    parser.add_argument('--radius', type=float, default=0.1)
+    parser.add_argument('--block_size', type=int, default=1024, help='block size of the tiled kNN / ball query')
+    parser.add_argument('--reducer', type=int, default=2, help='S = N // reducer, as in the first LocalGrouper')
+    parser.add_argument('--num_points', nargs='+', type=int, default=[1024, 2048, 4096, 16384])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    def run(fn):
+        if device == 'cuda':
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated() if device == 'cuda' else 0
+        try:
+            fn()  # warmup
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                out = fn()
+            if device == 'cuda':
+                torch.cuda.synchronize()
+        except RuntimeError:  # e.g. out of memory
+            return None, float('nan'), float('nan')
+        elapsed = (time.perf_counter() - start) / args.repeat
+        peak = (torch.cuda.max_memory_allocated() - base) / 2 ** 20 if device == 'cuda' else float('nan')
+        return out, elapsed, peak
+
+    def same(op, ref, out, xyz, new_xyz):
+        if ref is None or out is None:
+            return "n/a"
+        if op == 'knn_point':
+            # same neighbor distances (the neighbor order and ties are unspecified)
+            d_ref = torch.sum((index_points(xyz, ref) - new_xyz.unsqueeze(2)) ** 2, -1).sort(-1)[0]
+            d_out = torch.sum((index_points(xyz, out) - new_xyz.unsqueeze(2)) ** 2, -1).sort(-1)[0]
+            return bool(torch.allclose(d_ref, d_out, atol=1e-5))
+        if op == 'furthest_point_sample':
+            return bool(torch.equal(ref.sort(-1)[0], out.sort(-1)[0]))
+        return bool(torch.equal(ref, out))
+
+    backends = available_backends()
+    print(f"==> device: {device}, backends: {backends}, batch_size: {args.batch_size}, k: {args.k}, "
+          f"radius: {args.radius}, block_size: {args.block_size}")
+    print("op                     N      S      | backend        ms        MB | same as torch")
+    with torch.no_grad():
+        for N in args.num_points:
+            S = N // args.reducer
+            xyz = torch.rand(args.batch_size, N, 3, device=device)
+            new_xyz = xyz[:, torch.randperm(N, device=device)[:S]]
+            idx = torch.randint(0, N, (args.batch_size, S, args.k), device=device)
+            points = torch.rand(args.batch_size, N, 64, device=device)
+            start = torch.zeros(args.batch_size, dtype=torch.long, device=device)
+            ops = {
+                'index_points': {'torch': lambda: index_points(points, idx)},
+                'furthest_point_sample': {name: (lambda name=name: _FPS[name](xyz, S, start)) for name in backends},
+                'query_ball_point': {name: (lambda name=name: _BALL_QUERY[name](args.radius, args.k, xyz, new_xyz))
+                                     for name in backends},
+                'knn_point': {name: (lambda name=name: _KNN[name](args.k, xyz, new_xyz))
+                              for name in backends if name in _KNN},
+            }
+            ops['query_ball_point']['tiled'] = lambda: _ball_query_torch(args.radius, args.k, xyz, new_xyz,
+                                                                         args.block_size)
+            ops['knn_point']['tiled'] = lambda: _knn_torch(args.k, xyz, new_xyz, block_size=args.block_size)
+            for op, impls in ops.items():
+                ref = None
+                for name, fn in impls.items():
+                    out, elapsed, peak = run(fn)
+                    if name == 'torch':
+                        ref = out
+                    print(f"{op:<22} {N:<6} {S:<6} | {name:<13} {elapsed * 1e3:9.2f} {peak:9.1f} | "
+                          f"{same(op, ref, out, xyz, new_xyz) if name != 'torch' else '-'}")
@@ -22,9 +22,11 @@ import torch.optim.lr_scheduler as lr_scheduler
 
 from util import dataset, transform
 from util.s3dis import S3DIS
-from util.util import AverageMeter, intersectionAndUnionGPU, get_logger, get_parser
+from util.util import AverageMeter, get_logger, get_parser
+from util.metrics import ConfusionMatrix
 from utils import Logger, mkdir_p, progress_bar, save_model, save_args, cal_loss, get_screen_logger, set_seed
 import models as models
+from point_ops import set_knn_block_size
 
 os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
 
@@ -64,6 +66,8 @@ def parse_args():
     parser.add_argument('--optimizer', type=str, default='sgd', choices=["sgd", "adam"])
     parser.add_argument('--scheduler', type=str, default='cos', choices=["cos", "step"])
     parser.add_argument('--smoothing', type=float, default=0.)
+    parser.add_argument('--knn_block_size', type=int, default=None,
+                        help='tiled kNN over blocks of this many points, caps the [B, S, N] distances')
 
     return parser.parse_args()
 
@@ -136,6 +140,7 @@ def main():
 
     screen.info("==> Building model..\n")
     net = models.__dict__[args.model](num_classes=args.num_classes)
+    set_knn_block_size(net, args.knn_block_size)
     if args.weight_init:
         screen.info("==> Initialize weights to xavier_normal_..\n")
         net.apply(weight_init)
@@ -203,9 +208,7 @@ def train(train_loader, model, criterion, optimizer, epoch):
     batch_time = AverageMeter()
     data_time = AverageMeter()
     loss_meter = AverageMeter()
-    intersection_meter = AverageMeter()
-    union_meter = AverageMeter()
-    target_meter = AverageMeter()
+    metric = ConfusionMatrix(args.num_classes, ignore_index=args.ignore_label)
 
     model.train()
     end = time.time()
@@ -222,12 +225,7 @@ def train(train_loader, model, criterion, optimizer, epoch):
         loss.backward()
         optimizer.step()
 
-        output = output.max(1)[1]
-        intersection, union, target = intersectionAndUnionGPU(output, target, args.num_classes, args.ignore_label)
-        intersection, union, target = intersection.cpu().numpy(), union.cpu().numpy(), target.cpu().numpy()
-        intersection_meter.update(intersection), union_meter.update(union), target_meter.update(target)
-
-        accuracy = sum(intersection_meter.val) / (sum(target_meter.val) + 1e-10)
+        metric.update(output.detach(), target)
         loss_meter.update(loss.item(), input.size(0))
         batch_time.update(time.time() - end)
         end = time.time()
@@ -241,6 +239,7 @@ def train(train_loader, model, criterion, optimizer, epoch):
         remain_time = '{:02d}:{:02d}:{:02d}'.format(int(t_h), int(t_m), int(t_s))
 
         if (i + 1) % args.print_freq == 0:
+            accuracy = metric.allAcc()  # running accuracy of the epoch
             screen.info('Epoch: [{}/{}][{}/{}] '
                         'Data {data_time.val:.3f} ({data_time.avg:.3f}) '
                         'Batch {batch_time.val:.3f} ({batch_time.avg:.3f}) '
@@ -252,11 +251,7 @@ def train(train_loader, model, criterion, optimizer, epoch):
                                                           loss_meter=loss_meter,
                                                           accuracy=accuracy))
 
-    iou_class = intersection_meter.sum / (union_meter.sum + 1e-10)
-    accuracy_class = intersection_meter.sum / (target_meter.sum + 1e-10)
-    mIoU = np.mean(iou_class)
-    mAcc = np.mean(accuracy_class)
-    allAcc = sum(intersection_meter.sum) / (sum(target_meter.sum) + 1e-10)
+    mIoU, mAcc, allAcc = metric.mIoU(), metric.mAcc(), metric.allAcc()
     screen.info(
         'Train result at epoch [{}/{}]: mIoU/mAcc/allAcc {:.4f}/{:.4f}/{:.4f}.'.format(epoch + 1, args.epoch, mIoU,
                                                                                        mAcc, allAcc))
@@ -267,10 +262,8 @@ def validate(val_loader, model, criterion):
     screen.info('>>>>>>>>>>>>>>>> Start Evaluation >>>>>>>>>>>>>>>>')
     batch_time = AverageMeter()
     data_time = AverageMeter()
-    loss_meter = AverageMeter()
-    intersection_meter = AverageMeter()
-    union_meter = AverageMeter()
-    target_meter = AverageMeter()
+    metric = ConfusionMatrix(args.num_classes, ignore_index=args.ignore_label)
+    loss_sum, count = 0., 0
 
     model.eval()
     end = time.time()
@@ -280,40 +273,35 @@ def validate(val_loader, model, criterion):
         target = target.cuda(non_blocking=True)
         if target.shape[-1] == 1:
             target = target[:, 0]  # for cls
-        output = model(input)
-        loss = criterion(output, target)
-
-        output = output.max(1)[1]
-        intersection, union, target = intersectionAndUnionGPU(output, target, args.num_classes, args.ignore_label)
-        intersection, union, target = intersection.cpu().numpy(), union.cpu().numpy(), target.cpu().numpy()
-        intersection_meter.update(intersection), union_meter.update(union), target_meter.update(target)
-
-        accuracy = sum(intersection_meter.val) / (sum(target_meter.val) + 1e-10)
-        loss_meter.update(loss.item(), input.size(0))
+        with torch.no_grad():
+            output = model(input)
+            loss = criterion(output, target)
+        # loss and confusion stay on the GPU, they are only read back when printing.
+        metric.update(output, target)
+        loss_sum, count = loss_sum + loss * input.size(0), count + input.size(0)
         batch_time.update(time.time() - end)
         end = time.time()
         if (i + 1) % args.print_freq == 0:
+            accuracy = metric.allAcc()
             screen.info('Test: [{}/{}] '
                         'Data {data_time.val:.3f} ({data_time.avg:.3f}) '
                         'Batch {batch_time.val:.3f} ({batch_time.avg:.3f}) '
-                        'Loss {loss_meter.val:.4f} ({loss_meter.avg:.4f}) '
+                        'Loss {loss:.4f} ({loss_avg:.4f}) '
                         'Accuracy {accuracy:.4f}.'.format(i + 1, len(val_loader),
                                                           data_time=data_time,
                                                           batch_time=batch_time,
-                                                          loss_meter=loss_meter,
+                                                          loss=loss.item(),
+                                                          loss_avg=loss_sum.item() / count,
                                                           accuracy=accuracy))
 
-    iou_class = intersection_meter.sum / (union_meter.sum + 1e-10)
-    accuracy_class = intersection_meter.sum / (target_meter.sum + 1e-10)
-    mIoU = np.mean(iou_class)
-    mAcc = np.mean(accuracy_class)
-    allAcc = sum(intersection_meter.sum) / (sum(target_meter.sum) + 1e-10)
+    iou_class, accuracy_class = metric.iou(), metric.class_accuracy()
+    mIoU, mAcc, allAcc = metric.mIoU(), metric.mAcc(), metric.allAcc()
 
     screen.info('Val result: mIoU/mAcc/allAcc {:.4f}/{:.4f}/{:.4f}.'.format(mIoU, mAcc, allAcc))
     for i in range(args.num_classes):
         screen.info('Class_{} Result: iou/accuracy {:.4f}/{:.4f}.'.format(i, iou_class[i], accuracy_class[i]))
     screen.info('<<<<<<<<<<<<<<<<< End Evaluation <<<<<<<<<<<<<<<<<')
-    return loss_meter.avg, mIoU, mAcc, allAcc
+    return loss_sum.item() / count, mIoU, mAcc, allAcc
 
 class SmoothingCrossEntropyLoss(nn.Module):
     def __init__(self, trg_pad_idx=999999, smoothing=0.):
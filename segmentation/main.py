@@ -7,6 +7,7 @@ python main.py --model model31G --batch_size 32 --learning_rate 0.001 --optimize
 import argparse
 import os
 from S3DISDataLoader import S3DISDataset
+from metrics import ConfusionMatrix
 import torch
 import datetime
 import logging
@@ -137,8 +138,7 @@ def main(args):
         '''Train on chopped scenes'''
         printf('Epoch(%d/%s) Learning Rate %s:' % (epoch + 1, args.epoch, optimizer.param_groups[0]['lr']))
         num_batches = len(trainDataLoader)
-        total_correct = 0
-        total_seen = 0
+        metric = ConfusionMatrix(NUM_CLASSES)
         loss_sum = 0.
         classifier = classifier.train()
 
@@ -153,32 +153,24 @@ def main(args):
             seg_pred = classifier(points) # [b,n,num_classes]
             seg_pred = seg_pred.contiguous().view(-1, NUM_CLASSES)
 
-            batch_label = target.view(-1, 1)[:, 0].cpu().data.numpy()
             target = target.view(-1, 1)[:, 0]
             loss = criterion(seg_pred, target, weights)
             loss.backward()
             optimizer.step()
 
-            pred_choice = seg_pred.cpu().data.max(1)[1].numpy()
-            correct = np.sum(pred_choice == batch_label)
-            total_correct += correct
-            total_seen += (BATCH_SIZE * NUM_POINT)
-            loss_sum += loss.item()
+            metric.update(seg_pred.detach(), target)
+            loss_sum += loss.detach()
         printf('Training mean loss: %.6f  Training accuracy: %.6f' %
-               (loss_sum / num_batches, total_correct / float(total_seen)))
+               (loss_sum.item() / num_batches, metric.allAcc()))
         scheduler.step()
 
         '''Evaluate on chopped scenes'''
         classifier = classifier.eval()
         with torch.no_grad():
             num_batches = len(testDataLoader)
-            total_correct = 0
-            total_seen = 0
+            # confusion matrix and loss stay on the GPU, nothing is copied back per batch.
+            metric = ConfusionMatrix(NUM_CLASSES)
             loss_sum = 0
-            labelweights = np.zeros(NUM_CLASSES)
-            total_seen_class = [0 for _ in range(NUM_CLASSES)]
-            total_correct_class = [0 for _ in range(NUM_CLASSES)]
-            total_iou_deno_class = [0 for _ in range(NUM_CLASSES)]
             for i, (points, target) in tqdm(enumerate(testDataLoader), total=len(testDataLoader), smoothing=0.9):
                 points = points.data.numpy()
                 points = torch.Tensor(points)
@@ -186,38 +178,28 @@ def main(args):
                 points = points.transpose(2, 1)
 
                 seg_pred = classifier(points)
-                pred_val = seg_pred.contiguous().cpu().data.numpy()
                 seg_pred = seg_pred.contiguous().view(-1, NUM_CLASSES)
-
-                batch_label = target.cpu().data.numpy()
                 target = target.view(-1, 1)[:, 0]
                 loss = criterion(seg_pred, target, weights)
-                loss_sum += loss.item()
-                pred_val = np.argmax(pred_val, 2)
-                correct = np.sum((pred_val == batch_label))
-                total_correct += correct
-                total_seen += (BATCH_SIZE * NUM_POINT)
-                tmp, _ = np.histogram(batch_label, range(NUM_CLASSES + 1))
-                labelweights += tmp
-
-                for l in range(NUM_CLASSES):
-                    total_seen_class[l] += np.sum((batch_label == l))
-                    total_correct_class[l] += np.sum((pred_val == l) & (batch_label == l))
-                    total_iou_deno_class[l] += np.sum(((pred_val == l) | (batch_label == l)))
-
-            labelweights = labelweights.astype(np.float32) / np.sum(labelweights.astype(np.float32))
-            mIoU = np.mean(np.array(total_correct_class) / (np.array(total_iou_deno_class, dtype=np.float) + 1e-6))
+                loss_sum += loss
+                metric.update(seg_pred, target)
+
+            _, _, labelweights = metric.intersection_union_target()
+            labelweights = labelweights.cpu().numpy().astype(np.float32)
+            labelweights = labelweights / np.sum(labelweights)
+            iou_class = metric.iou()
+            mIoU = float(np.mean(iou_class))
             printf('eval mean loss: %f, avg class IoU: %f, accuracy: %f, avg class acc: %f' %
-                   (loss_sum / float(num_batches),
+                   (loss_sum.item() / float(num_batches),
                     mIoU,
-                    total_correct / float(total_seen),
-                    np.mean(np.array(total_correct_class) / (np.array(total_seen_class, dtype=np.float) + 1e-6))
+                    metric.allAcc(),
+                    metric.mAcc()
                     ))
             iou_per_class_str = '------- IoU --------\n'
             for l in range(NUM_CLASSES):
                 iou_per_class_str += 'class %s weight: %.3f, IoU: %.3f \n' % (
                     seg_label_to_cat[l] + ' ' * (14 - len(seg_label_to_cat[l])), labelweights[l - 1],
-                    total_correct_class[l] / float(total_iou_deno_class[l]))
+                    iou_class[l])
 
             printf(iou_per_class_str)
 
@@ -5,6 +5,7 @@ import numpy as np
 import logging
 import pickle
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
 import torch.nn as nn
@@ -12,7 +13,9 @@ import torch.nn.parallel
 import torch.optim
 import torch.utils.data
 
-from util.util import AverageMeter, intersectionAndUnion, check_makedirs, get_parser, get_logger
+from util.util import AverageMeter, intersectionAndUnion, intersectionAndUnionGPU, check_makedirs, get_parser, \
+    get_logger
+from util.s3dis import tile_room
 
 random.seed(123)
 np.random.seed(123)
@@ -56,44 +59,16 @@ def data_prepare(room_path):
     points, labels = room_data[:, 0:6], room_data[:, 6]  # xyzrgb, N*6; l, N
     coord_min, coord_max = np.amin(points, axis=0)[:3], np.amax(points, axis=0)[:3]
     stride = args.block_size * args.stride_rate
-    grid_x = int(np.ceil(float(coord_max[0] - coord_min[0] - args.block_size) / stride) + 1)
-    grid_y = int(np.ceil(float(coord_max[1] - coord_min[1] - args.block_size) / stride) + 1)
-    data_room, label_room, index_room = np.array([]), np.array([]), np.array([])
-    for index_y in range(0, grid_y):
-        for index_x in range(0, grid_x):
-            s_x = coord_min[0] + index_x * stride
-            e_x = min(s_x + args.block_size, coord_max[0])
-            s_x = e_x - args.block_size
-            s_y = coord_min[1] + index_y * stride
-            e_y = min(s_y + args.block_size, coord_max[1])
-            s_y = e_y - args.block_size
-            point_idxs = np.where((points[:, 0] >= s_x - 1e-8) & (points[:, 0] <= e_x + 1e-8) & (points[:, 1] >= s_y - 1e-8) & (points[:, 1] <= e_y + 1e-8))[0]
-            if point_idxs.size == 0:
-                continue
-            num_batch = int(np.ceil(point_idxs.size / args.num_point))
-            point_size = int(num_batch * args.num_point)
-            replace = False if (point_size - point_idxs.size <= point_idxs.size) else True
-            point_idxs_repeat = np.random.choice(point_idxs, point_size - point_idxs.size, replace=replace)
-            point_idxs = np.concatenate((point_idxs, point_idxs_repeat))
-            np.random.shuffle(point_idxs)
-            data_batch = points[point_idxs, :]
-            normlized_xyz = np.zeros((point_size, 3))
-            normlized_xyz[:, 0] = data_batch[:, 0] / coord_max[0]
-            normlized_xyz[:, 1] = data_batch[:, 1] / coord_max[1]
-            normlized_xyz[:, 2] = data_batch[:, 2] / coord_max[2]
-            data_batch[:, 0] = data_batch[:, 0] - (s_x + args.block_size / 2.0)
-            data_batch[:, 1] = data_batch[:, 1] - (s_y + args.block_size / 2.0)
-            data_batch[:, 3:6] /= 255.0
-
-            fea_dim = args.get('fea_dim', 6)
-            if fea_dim == 3:
-                data_batch = data_batch
-            elif fea_dim == 6:
-                data_batch = np.concatenate((data_batch, normlized_xyz), axis=-1)
-            label_batch = labels[point_idxs]
-            data_room = np.vstack([data_room, data_batch]) if data_room.size else data_batch
-            label_room = np.hstack([label_room, label_batch]) if label_room.size else label_batch
-            index_room = np.hstack([index_room, point_idxs]) if index_room.size else point_idxs
+    index_room, center_room = tile_room(points[:, :2], coord_min, coord_max, block_size=args.block_size,
+                                        stride=stride, num_point=args.num_point, padding=1e-8)
+    fea_dim = args.get('fea_dim', 6)
+    data_room = np.zeros((index_room.size, 9 if fea_dim == 6 else 6))
+    data_room[:, 0:6] = points[index_room, :]
+    if fea_dim == 6:
+        data_room[:, 6:9] = data_room[:, 0:3] / coord_max  # normlized_xyz
+    data_room[:, 0:2] -= center_room
+    data_room[:, 3:6] /= 255.0
+    label_room = labels[index_room]
     assert np.unique(index_room).size == labels.size
     return data_room, label_room, index_room, labels
 
@@ -111,28 +86,40 @@ def test(model, criterion, names):
     gt_all, pred_all = np.array([]), np.array([])
     check_makedirs(args.save_folder)
     pred_save, gt_save = [], []
+    batch_point = args.num_point * args.test_batch_size
+    # prepare the next room on a background thread while the GPU runs the current one;
+    # a single worker keeps the np.random calls in room order.
+    executor = ThreadPoolExecutor(max_workers=1)
+    room_paths = [os.path.join(args.train_full_folder, room_name) for room_name in rooms_split]
+    future = executor.submit(data_prepare, room_paths[0])
     for idx, room_name in enumerate(rooms_split):
-        data_room, label_room, index_room, gt = data_prepare(os.path.join(args.train_full_folder, room_name))
-        batch_point = args.num_point * args.test_batch_size
+        data_room, label_room, index_room, gt = future.result()
+        if idx + 1 < len(rooms_split):
+            future = executor.submit(data_prepare, room_paths[idx + 1])
         batch_num = int(np.ceil(label_room.size / batch_point))
         end = time.time()
-        output_room = np.array([])
+        data_room = torch.from_numpy(data_room).float().pin_memory()
+        label_room = torch.from_numpy(label_room).long().pin_memory()
+        index_room = torch.from_numpy(index_room).pin_memory()
+        # votes are summed on the GPU with index_add_, nothing is copied back until the room is done.
+        pred = torch.zeros((gt.size, args.classes)).cuda()
         for i in range(batch_num):
             s_i, e_i = i * batch_point, min((i + 1) * batch_point, label_room.size)
-            input, target, index = data_room[s_i:e_i, :], label_room[s_i:e_i], index_room[s_i:e_i]
-            input = torch.from_numpy(input).float().view(-1, args.num_point, input.shape[1])
-            target = torch.from_numpy(target).long().view(-1, args.num_point)
+            input = data_room[s_i:e_i, :].view(-1, args.num_point, data_room.shape[1]).cuda(non_blocking=True)
+            target = label_room[s_i:e_i].view(-1, args.num_point).cuda(non_blocking=True)
+            index = index_room[s_i:e_i].cuda(non_blocking=True)
             with torch.no_grad():
-                output = model(input.cuda())
-            loss = criterion(output, target.cuda())  # for reference
-            output = output.transpose(1, 2).contiguous().view(-1, args.classes).data.cpu().numpy()
-            pred = np.argmax(output, axis=1)
-            intersection, union, target = intersectionAndUnion(pred, target.view(-1).data.cpu().numpy(), args.classes, args.ignore_label)
-            accuracy = sum(intersection) / (sum(target) + 1e-10)
-            output_room = np.vstack([output_room, output]) if output_room.size else output
+                output = model(input)
+                loss = criterion(output, target)  # for reference
+                output = output.transpose(1, 2).contiguous().view(-1, args.classes)
+                pred.index_add_(0, index, output)
             batch_time.update(time.time() - end)
             end = time.time()
             if ((i + 1) % args.print_freq == 0) or (i + 1 == batch_num):
+                # only synchronize with the GPU when logging.
+                intersection, union, target = intersectionAndUnionGPU(output.max(1)[1], target.view(-1),
+                                                                      args.classes, args.ignore_label)
+                accuracy = intersection.sum().item() / (target.sum().item() + 1e-10)
                 logger.info('Test: [{}/{}]-[{}/{}] '
                             'Batch {batch_time.val:.3f} ({batch_time.avg:.3f}) '
                             'Loss {loss:.4f} '
@@ -140,21 +127,10 @@ def test(model, criterion, names):
                             'Points {gt.size}.'.format(idx + 1, len(rooms_split),
                                                        i + 1, batch_num,
                                                        batch_time=batch_time,
-                                                       loss=loss,
+                                                       loss=loss.item(),
                                                        accuracy=accuracy,
                                                        gt=gt))
-        '''
-        unq, unq_inv, unq_cnt = np.unique(index_room, return_inverse=True, return_counts=True)
-        index_array = np.split(np.argsort(unq_inv), np.cumsum(unq_cnt[:-1]))
-        output_room = np.vstack([output_room, np.zeros((1, args.classes))])
-        index_array_fill = np.array(list(itertools.zip_longest(*index_array, fillvalue=output_room.shape[0] - 1))).T
-        pred = output_room[index_array_fill].sum(1)
-        pred = np.argmax(pred, axis=1)
-        '''
-        pred = np.zeros((gt.size, args.classes))
-        for j in range(len(index_room)):
-            pred[index_room[j]] += output_room[j]
-        pred = np.argmax(pred, axis=1)
+        pred = pred.max(1)[1].cpu().numpy()
 
         # calculation 1: add per room predictions
         intersection, union, target = intersectionAndUnion(pred, gt, args.classes, args.ignore_label)
@@ -165,6 +141,7 @@ def test(model, criterion, names):
         pred_all = np.hstack([pred_all, pred]) if pred_all.size else pred
         gt_all = np.hstack([gt_all, gt]) if gt_all.size else gt
         pred_save.append(pred), gt_save.append(gt)
+    executor.shutdown()
 
     with open(os.path.join(args.save_folder, "pred_{}.pickle".format(args.test_area)), 'wb') as handle:
         pickle.dump({'pred': pred_save}, handle, protocol=pickle.HIGHEST_PROTOCOL)
@@ -1,13 +1,150 @@
 import os
+import shutil
 import numpy as np
 
 import torch
 from torch.utils.data import Dataset
 # max_points: tensor([9,273,742]) | min_points: tensor([85,855])
 
+def tile_room(xy, coord_min, coord_max, block_size=1.0, stride=0.5, num_point=4096, padding=1e-8):
+    """
+    Whole-room sliding-window tiling, same windows, point order and np.random calls as the grid_y x grid_x loop
+    (window [s, e] clamped to the room, points within padding of it), without a full-room np.where per window.
+    Windows are sorted on each axis, so the windows covering a point form a contiguous range that searchsorted
+    finds for all points at once. Each non-empty window is padded to a multiple of num_point by random repeats.
+    Input:
+        xy: [N, 2]; coord_min, coord_max: room bounds, [3]
+    Return:
+        index_room: point index of every output point, [M] (M is a multiple of num_point)
+        center_room: xy center of the window of every output point, [M, 2]
+    """
+    window_start, low, count = [], [], []
+    for axis in range(2):
+        grid = int(np.ceil(float(coord_max[axis] - coord_min[axis] - block_size) / stride) + 1)
+        e = np.minimum(coord_min[axis] + np.arange(grid) * stride + block_size, coord_max[axis])
+        s = e - block_size
+        # first window ending after x, last window starting before x
+        first = np.searchsorted(e + padding, xy[:, axis], side='left')
+        last = np.searchsorted(s - padding, xy[:, axis], side='right') - 1
+        window_start.append(s), low.append(first), count.append(np.maximum(last - first + 1, 0))
+    grid_x, grid_y = window_start[0].size, window_start[1].size
+
+    # one (window, point) pair per covering window, window id = index_y * grid_x + index_x as in the loop
+    num_windows = count[0] * count[1]
+    point_rep = np.repeat(np.arange(xy.shape[0]), num_windows)
+    local = np.arange(point_rep.size) - np.repeat(np.cumsum(num_windows) - num_windows, num_windows)
+    count_x = count[0][point_rep]
+    window = (low[1][point_rep] + local // count_x) * grid_x + low[0][point_rep] + local % count_x
+    order = np.argsort(window, kind='stable')  # points stay in ascending order inside a window, like np.where
+    window, point_rep = window[order], point_rep[order]
+
+    window_size = np.bincount(window, minlength=grid_x * grid_y)
+    window_offset = np.cumsum(window_size) - window_size
+    padded_size = np.ceil(window_size / num_point).astype(np.int64) * num_point
+    index_room = np.empty(padded_size.sum(), dtype=np.int64)
+    center_room = np.empty((padded_size.sum(), 2))
+    out = 0
+    for w in np.nonzero(window_size)[0]:
+        size, point_size = window_size[w], padded_size[w]
+        point_idxs = point_rep[window_offset[w]:window_offset[w] + size]
+        replace = False if (point_size - size <= size) else True
+        point_idxs_repeat = np.random.choice(point_idxs, point_size - size, replace=replace)
+        block = index_room[out:out + point_size]
+        block[:size], block[size:] = point_idxs, point_idxs_repeat
+        np.random.shuffle(block)
+        center_room[out:out + point_size, 0] = window_start[0][w % grid_x] + block_size / 2.0
+        center_room[out:out + point_size, 1] = window_start[1][w // grid_x] + block_size / 2.0
+        out += point_size
+    return index_room, center_room
+
+
+def build_room_store(data_root, store_root=None):
+    """
+    One-time conversion of the Area_*.npy rooms (xyzrgbl, N*7) into a compact store next to data_root:
+        xyz.npy (float32, T*3), rgb.npy (uint8, T*3), label.npy (uint8, T), offsets.npy (int64, R+1),
+        coord_min.npy / coord_max.npy (float64, R*3, from the original data), rooms.txt (file names)
+    with room i in rows offsets[i]:offsets[i + 1]. 16 bytes per point instead of 56.
+    Delete the store to rebuild it after the rooms change.
+    Return: store_root
+    """
+    store_root = data_root.rstrip('/') + '_store' if store_root is None else store_root
+    if os.path.exists(os.path.join(store_root, 'rooms.txt')):
+        return store_root
+    rooms = sorted([room for room in os.listdir(data_root) if 'Area_' in room])
+    sizes = [np.load(os.path.join(data_root, room), mmap_mode='r').shape[0] for room in rooms]
+    offsets = np.zeros(len(rooms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(sizes)
+    # write to a per-process temporary directory first, so concurrent jobs never see a half-written store.
+    tmp_root = '%s.%d.tmp' % (store_root, os.getpid())
+    try:
+        os.makedirs(tmp_root, exist_ok=True)
+        num_total = int(offsets[-1])
+        path = lambda name: os.path.join(tmp_root, name)
+        xyz = np.lib.format.open_memmap(path('xyz.npy'), mode='w+', dtype=np.float32, shape=(num_total, 3))
+        rgb = np.lib.format.open_memmap(path('rgb.npy'), mode='w+', dtype=np.uint8, shape=(num_total, 3))
+        label = np.lib.format.open_memmap(path('label.npy'), mode='w+', dtype=np.uint8, shape=(num_total,))
+        coord_min, coord_max = np.zeros((len(rooms), 3)), np.zeros((len(rooms), 3))
+        for i, room in enumerate(rooms):
+            room_data = np.load(os.path.join(data_root, room))  # xyzrgbl, N*7
+            assert room_data[:, 6].min() >= 0 and room_data[:, 6].max() <= 255, "labels should fit in uint8"
+            s, e = offsets[i], offsets[i + 1]
+            xyz[s:e], rgb[s:e], label[s:e] = room_data[:, 0:3], np.round(room_data[:, 3:6]), room_data[:, 6]
+            coord_min[i], coord_max[i] = np.amin(room_data[:, 0:3], axis=0), np.amax(room_data[:, 0:3], axis=0)
+        xyz.flush(), rgb.flush(), label.flush()
+        del xyz, rgb, label
+        np.save(path('offsets.npy'), offsets)
+        np.save(path('coord_min.npy'), coord_min)
+        np.save(path('coord_max.npy'), coord_max)
+        with open(path('rooms.txt'), 'w') as f:
+            f.write('\n'.join(rooms) + '\n')
+    except OSError:
+        shutil.rmtree(tmp_root, ignore_errors=True)
+        raise
+    try:
+        os.replace(tmp_root, store_root)
+    except OSError:  # another process finished first
+        shutil.rmtree(tmp_root)
+    return store_root
+
+
+class RoomStore(object):
+    """
+    Read-only view of a build_room_store directory. Every room is a slice of the memory-mapped arrays, so
+    opening the store copies nothing and the pages are shared by all DataLoader workers through the page cache.
+    """
+    def __init__(self, store_root):
+        self.rooms = [line.rstrip('\n') for line in open(os.path.join(store_root, 'rooms.txt'))]
+        self.room_index = {room: i for i, room in enumerate(self.rooms)}
+        self.offsets = np.load(os.path.join(store_root, 'offsets.npy'))
+        self.coord_min = np.load(os.path.join(store_root, 'coord_min.npy'))
+        self.coord_max = np.load(os.path.join(store_root, 'coord_max.npy'))
+        self.xyz = np.load(os.path.join(store_root, 'xyz.npy'), mmap_mode='r')
+        self.rgb = np.load(os.path.join(store_root, 'rgb.npy'), mmap_mode='r')
+        self.label = np.load(os.path.join(store_root, 'label.npy'), mmap_mode='r')
+
+    def __getitem__(self, room_name):
+        """
+        Return: xyz [N, 3] float32, rgb [N, 3] uint8, label [N] uint8, coord_min [3], coord_max [3]
+        """
+        i = self.room_index[room_name]
+        s, e = self.offsets[i], self.offsets[i + 1]
+        return self.xyz[s:e], self.rgb[s:e], self.label[s:e], self.coord_min[i], self.coord_max[i]
+
+
+def open_room_store(data_root):
+    """
+    RoomStore of data_root, built on first use. None if the store cannot be written (e.g. read-only dataset
+    location): the caller then reads the Area_*.npy rooms directly.
+    """
+    try:
+        return RoomStore(build_room_store(data_root))
+    except OSError:
+        return None
+
+
 class S3DIS(Dataset):
     def __init__(self, split='train', data_root='trainval_fullarea', num_point=None, test_area=5,
-                 sample_rate=1.0, transform=None, shuffle_idx=False):
+                 sample_rate=1.0, transform=None, shuffle_idx=False, use_store=False):
 
         super().__init__()
         self.split = split
@@ -20,15 +157,21 @@ class S3DIS(Dataset):
             rooms_split = [room for room in rooms if not 'Area_{}'.format(test_area) in room]
         else:
             rooms_split = [room for room in rooms if 'Area_{}'.format(test_area) in room]
-        self.room_points, self.room_labels = [], []
+        self.room_xyz, self.room_rgb, self.room_labels = [], [], []
         self.room_coord_min, self.room_coord_max = [], []
+        # use_store: float32 xyz, uint8 rgb/labels memory-mapped from trainval_fullarea_store/, built on first
+        # use. Opt-in, as float32 xyz can move points across block borders in whole-scene evaluation.
+        store = open_room_store(data_root) if use_store else None
         num_point_all = []
         for room_name in rooms_split:
-            room_path = os.path.join(data_root, room_name)
-            room_data = np.load(room_path)  # xyzrgbl, N*7
-            points, labels = room_data[:, 0:6], room_data[:, 6]  # xyzrgb, N*6; l, N
-            coord_min, coord_max = np.amin(points, axis=0)[:3], np.amax(points, axis=0)[:3]
-            self.room_points.append(points), self.room_labels.append(labels)
+            if store is not None:
+                xyz, rgb, labels, coord_min, coord_max = store[room_name]
+            else:
+                room_path = os.path.join(data_root, room_name)
+                room_data = np.load(room_path)  # xyzrgbl, N*7
+                xyz, rgb, labels = room_data[:, 0:3], room_data[:, 3:6], room_data[:, 6]  # xyz, N*3; rgb, N*3; l, N
+                coord_min, coord_max = np.amin(xyz, axis=0), np.amax(xyz, axis=0)
+            self.room_xyz.append(xyz), self.room_rgb.append(rgb), self.room_labels.append(labels)
             self.room_coord_min.append(coord_min), self.room_coord_max.append(coord_max)
             num_point_all.append(labels.size)
         sample_prob = num_point_all / np.sum(num_point_all)
@@ -41,29 +184,26 @@ class S3DIS(Dataset):
 
     def __getitem__(self, idx):
         room_idx = self.room_idxs[idx]
-        points = self.room_points[room_idx]   # N * 6
+        xyz, rgb = self.room_xyz[room_idx], self.room_rgb[room_idx]   # N * 3
         labels = self.room_labels[room_idx]   # N
-        N_points = points.shape[0]
+        N_points = xyz.shape[0]
         # print(f"room_idx: {room_idx}| points shape:{ points.shape} | labels shape:{labels.shape}")
 
         if self.num_point is not None:
             if N_points < self.num_point:
                 # simply copy some points
                 append_index = np.random.choice(range(N_points), self.num_point-N_points, replace=False)
-                selected_points = np.concatenate((points,points[append_index]),axis=0)
-                selected_lables = np.concatenate((labels,labels[append_index]),axis=0)
+                selected_index = np.concatenate((np.arange(N_points), append_index), axis=0)
             else:
                 selected_index = np.random.choice(range(N_points), self.num_point, replace=False)
-                selected_points = points[selected_index,:]
-                selected_lables = labels[selected_index]
         else:
-            selected_points = points
-            selected_lables = labels
+            selected_index = np.arange(N_points)
+        selected_lables = labels[selected_index]
 
         # normalized colors
-        normalized_colors = selected_points[:, 3:6] / 255.0
+        normalized_colors = rgb[selected_index, :] / 255.0
         # normalized points
-        normalized_points = selected_points[:, :3] / self.room_coord_max[room_idx]
+        normalized_points = xyz[selected_index, :] / self.room_coord_max[room_idx]
 
         # transformation for centered points and normalized colors
         if self.transform is not None:
@@ -0,0 +1,7 @@
+#pip install -e .   (once, from the repository root: the models of every project import point_ops/fuse_bn)
+from setuptools import setup
+
+setup(
+    name='pointmlp-ops',
+    version='0.1',
+    py_modules=['point_ops', 'fuse_bn'])